@@ -0,0 +1,61 @@
+from rembg import remove, new_session
+import hashlib
+
+from disk_cache import cached, cache_folder, load_image, save_image
+
+DEFAULT_MODEL = 'u2net'
+
+# bump this to ignore cutouts cached by an older version
+CUTOUT_CACHE_VERSION = 1
+
+CUTOUT_CACHE_DIR = cache_folder('.cutout_cache')
+
+# one rembg session per model, kept for the life of the process
+_sessions = {}
+
+def get_session(model_name=DEFAULT_MODEL):
+    # loading the model is the slow part of rembg, so only do it once
+    if model_name not in _sessions:
+        _sessions[model_name] = new_session(model_name)
+    return _sessions[model_name]
+
+def cutout_key(image, model_name=DEFAULT_MODEL):
+    """
+    Cache key of a cutout: the image's mode, size and pixels, the model
+    name and the cache version.
+    """
+    digest = hashlib.sha256(('v%d|%s|%s|%r|' % (CUTOUT_CACHE_VERSION, model_name, image.mode, image.size)).encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+def remove_background(image, model_name=DEFAULT_MODEL, cache_dir=CUTOUT_CACHE_DIR):
+    """
+    Remove the background of an image with rembg, reusing the model session
+    and cutouts from earlier runs.
+
+    :param image: PIL image.
+    :param model_name: rembg model to use.
+    :param cache_dir: Folder for the cached cutouts, None disables the cache.
+    :return: RGBA PIL image of the cutout.
+    """
+    if cache_dir is None:
+        return remove(image, session=get_session(model_name))
+    return cached(cutout_key(image, model_name), cache_dir, load_image, save_image,
+                  lambda: remove(image, session=get_session(model_name)), '.png')
+
+def remove_backgrounds(images, model_name=DEFAULT_MODEL, cache_dir=CUTOUT_CACHE_DIR):
+    """
+    remove_background for a batch of images, sharing one session. Images
+    with the same content are only cut out once.
+
+    :param images: List of PIL images.
+    :return: List of cutouts in the same order.
+    """
+    cutouts = {}
+    results = []
+    for image in images:
+        key = cutout_key(image, model_name)
+        if key not in cutouts:
+            cutouts[key] = remove_background(image, model_name, cache_dir)
+        results.append(cutouts[key])
+    return results
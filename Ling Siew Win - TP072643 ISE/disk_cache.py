@@ -0,0 +1,55 @@
+from PIL import Image
+import os
+
+def cache_folder(name):
+    # cache folder next to this file, the names used are ignored by git
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+def cache_path(cache_dir, key, extension):
+    # file an entry is stored in
+    return os.path.join(cache_dir, key + extension)
+
+def load_image(path):
+    # read the whole file so it is closed before returning
+    with Image.open(path) as image:
+        image.load()
+        return image
+
+def save_image(image, path):
+    image.save(path, format='PNG')
+
+def cached(key, cache_dir, load, save, compute, extension='.png'):
+    """
+    Result of compute, reused from the cache folder while key stays the
+    same.
+
+    Entries are written under a temporary name first and then renamed, so
+    a crash or another process never leaves or reads half a file.
+
+    :param key: Name of the entry, a hex digest of everything the result
+                depends on including a cache version.
+    :param cache_dir: Folder for the entries, None disables the cache.
+    :param load: Function reading an entry from a path.
+    :param save: Function writing (result, path).
+    :param compute: Function making the result. A None result is returned
+                    without being cached.
+    :param extension: File extension of the entries, save may pick the
+                      format from it.
+    :return: The cached or computed result.
+    """
+    if cache_dir is None:
+        return compute()
+
+    path = cache_path(cache_dir, key, extension)
+    if os.path.exists(path):
+        return load(path)
+
+    result = compute()
+    if result is None:
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = '%s.%d%s' % (path[:-len(extension)], os.getpid(), extension)
+    save(result, temp_path)
+    os.replace(temp_path, path)
+    return result
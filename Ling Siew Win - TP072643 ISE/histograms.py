@@ -0,0 +1,93 @@
+from matplotlib.colors import to_rgb
+import numpy as np
+import hashlib
+
+from disk_cache import cached, cache_folder
+
+# bump this to ignore histograms cached by an older version
+HISTOGRAM_CACHE_VERSION = 1
+
+HISTOGRAM_CACHE_DIR = cache_folder('.histogram_cache')
+
+# pixels counted per bincount call, keeps the index buffer small
+_CHUNK_PIXELS = 1 << 18
+
+def count_channels(image):
+    """
+    Histograms of every channel of an 8 bit image in one bincount pass.
+
+    Channel c of each pixel is counted in bin c * 256 + value, so one
+    bincount over the interleaved pixels gives all channels at once.
+
+    :param image: PIL image or uint8 array, gray, RGB or RGBA.
+    :return: int64 array of shape (channels, 256) with the raw counts.
+    """
+    pixels = np.asarray(image)
+    channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+    pixels = pixels.reshape(-1, channels)
+    offsets = np.arange(channels, dtype=np.intp) << 8
+
+    counts = np.zeros(channels * 256, dtype=np.int64)
+    indices = np.empty((min(_CHUNK_PIXELS, len(pixels)), channels), dtype=np.intp)
+    for start in range(0, len(pixels), _CHUNK_PIXELS):
+        chunk = pixels[start:start + _CHUNK_PIXELS]
+        chunk_indices = indices[:len(chunk)]
+        np.add(chunk, offsets, out=chunk_indices)
+        counts += np.bincount(chunk_indices.ravel(), minlength=channels * 256)
+    return counts.reshape(channels, 256)
+
+def histogram_key(pixels):
+    """
+    Cache key of an image's histograms: its shape, type and pixels and the
+    cache version.
+    """
+    pixels = np.ascontiguousarray(pixels)
+    digest = hashlib.sha256(('v%d|%s|%r|' % (HISTOGRAM_CACHE_VERSION, pixels.dtype.str, pixels.shape)).encode())
+    digest.update(pixels.data)
+    return digest.hexdigest()
+
+def channel_histograms(image, cache_dir=HISTOGRAM_CACHE_DIR):
+    """
+    count_channels, reusing the counts from an earlier run when the image
+    is the same.
+
+    :param image: PIL image or uint8 array.
+    :param cache_dir: Folder for the cached counts, None disables the cache.
+    :return: int64 array of shape (channels, 256).
+    """
+    pixels = np.asarray(image)
+    if cache_dir is None:
+        return count_channels(pixels)
+    return cached(histogram_key(pixels), cache_dir, np.load, lambda counts, path: np.save(path, counts),
+                  lambda: count_channels(pixels), '.npy')
+
+def draw_histogram(ax, counts, color, alpha=0.6):
+    # one filled step outline instead of a bar patch per bin
+    return ax.stairs(counts, np.arange(len(counts) + 1), fill=True, color=color, alpha=alpha)
+
+def histogram_image(histograms, colors, height=128, columns=3, alpha=0.6, gap=8):
+    """
+    Render histograms as bar charts into one RGB image, so a whole set can
+    be shown with a single imshow.
+
+    Every histogram gets a panel 256 pixels wide, scaled to its own
+    largest bin, and the panels are laid out in rows of columns.
+
+    :param histograms: List of 256 bin counts.
+    :param colors: Matplotlib colour of each histogram.
+    :param height: Height of a panel in pixels.
+    :param alpha: Opacity of the bars over the white background.
+    :param gap: White space between panels in pixels.
+    :return: uint8 RGB image.
+    """
+    rows = -(-len(histograms) // columns)
+    image = np.full((rows * (height + gap) - gap, columns * (256 + gap) - gap, 3), 255, dtype=np.uint8)
+    levels = np.arange(height, 0, -1)[:, np.newaxis]
+
+    for i, (counts, color) in enumerate(zip(histograms, colors)):
+        top, left = (i // columns) * (height + gap), (i % columns) * (256 + gap)
+        bar_heights = np.round(counts * (height / max(counts.max(), 1)))
+        bars = levels <= bar_heights
+        bar_color = np.round(np.multiply(to_rgb(color), 255 * alpha) + 255 * (1 - alpha)).astype(np.uint8)
+        image[top:top + height, left:left + 256][bars] = bar_color
+    return image
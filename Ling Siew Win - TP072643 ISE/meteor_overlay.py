@@ -1,39 +1,238 @@
 import cv2
 import numpy as np
 from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+import hashlib
+import inspect
+import math
+import os
+import queue
+import threading
+
+from sprite_blend import prepare_sprite, blend_sprite
+from disk_cache import cached, cache_folder, cache_path
+
+# marks the end of a stream of frames passed through a queue
+_END = object()
 
 def extract_frames(video_path):
+    # decode one frame at a time, so the clip is never held in memory
     cap = cv2.VideoCapture(video_path)
-    frames = []
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frames.append(frame)
-    cap.release()
-    return frames
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+    finally:
+        cap.release()
+
+def _put(frame_queue, item, stop):
+    # block until there is room in the queue, or give up once stop is set
+    while not stop.is_set():
+        try:
+            frame_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def prefetch(frames, queue_size=8):
+    """
+    Pull frames from an iterable on a background thread.
+
+    At most queue_size frames wait in the queue, so memory stays flat for
+    any clip length while decoding overlaps with the caller's work. Errors
+    raised while decoding are raised again in the caller.
+    """
+    frame_queue = queue.Queue(queue_size)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for frame in frames:
+                if not _put(frame_queue, frame, stop):
+                    break
+            _put(frame_queue, _END, stop)
+        except Exception as error:
+            _put(frame_queue, error, stop)
+        finally:
+            # runs extract_frames' cleanup on this thread if we stopped early
+            if hasattr(frames, 'close'):
+                frames.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = frame_queue.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+class BackgroundWriter:
+    """
+    Wraps a cv2.VideoWriter so frames are encoded on their own thread.
+
+    write only queues the frame, so the frame must not be modified
+    afterwards. At most queue_size frames wait to be encoded. Errors from
+    the writer are raised again on the next write or on release.
+
+    :param writer: cv2.VideoWriter to encode with.
+    :param queue_size: Number of frames that can wait to be encoded.
+    :param size: (width, height) to resize frames to on the encode thread,
+                 None writes them as they are.
+    """
+
+    def __init__(self, writer, queue_size=8, size=None):
+        self.writer = writer
+        self.size = size
+        self.queue = queue.Queue(queue_size)
+        self.stop = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._encode, daemon=True)
+        self.thread.start()
+
+    def _encode(self):
+        try:
+            while True:
+                frame = self.queue.get()
+                if frame is _END:
+                    break
+                if self.size is not None:
+                    frame = downscale_frame(frame, self.size)
+                self.writer.write(frame)
+        except Exception as error:
+            self.error = error
+            self.stop.set()
+
+    def write(self, frame):
+        if not _put(self.queue, frame, self.stop):
+            raise self.error
+
+    def release(self):
+        _put(self.queue, _END, self.stop)
+        self.thread.join()
+        self.writer.release()
+        if self.error is not None:
+            raise self.error
 
 def resize_frame(frame, size):
     return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
 
-def create_sky_mask(image):
+def _halve_frame(frame):
+    # exact 2x2 averages, OpenCV has a fast path for integer INTER_AREA scales
+    h, w = frame.shape[:2]
+    return cv2.resize(frame[:h // 2 * 2, :w // 2 * 2], (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+
+def downscale_frame(frame, size):
+    """
+    Resize a frame to size. Large downscales are first halved with 2x2
+    averages, which are much cheaper than INTER_AREA at a fractional scale
+    over the full source, and finished with INTER_AREA.
+    """
+    while frame.shape[1] >= 2 * size[0] and frame.shape[0] >= 2 * size[1]:
+        frame = _halve_frame(frame)
+    if (frame.shape[1], frame.shape[0]) == tuple(size):
+        return frame
+    return resize_frame(frame, size)
+
+def resize_frames(frames, size, workers=2, queue_size=8):
+    """
+    Downscale frames on a small thread pool, keeping them in order.
+
+    OpenCV releases the GIL while resizing, so the workers run alongside
+    decoding and compositing. At most queue_size frames are in flight.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for frame in frames:
+            pending.append(pool.submit(downscale_frame, frame, size))
+            if len(pending) >= queue_size:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+class ComparisonPreview:
+    """
+    Shows a comparison of the base image and the output while rendering.
+
+    Every Nth frame is sampled into a one slot queue, and update draws the
+    waiting sample and polls the window with waitKey(1). OpenCV windows
+    only work from the main thread on macOS and some Qt builds, so update
+    has to be called from the compositing loop, never from a helper
+    thread. Pressing q in the window sets quit.
+
+    :param base_image: Image shown to the left of each frame.
+    :param every: Preview every Nth frame.
+    """
+
+    def __init__(self, base_image, every=1, window='Comparison Frame'):
+        self.base_image = base_image
+        self.every = every
+        self.window = window
+        self.queue = queue.Queue(1)
+        self.quit = False
+        self.enabled = True
+        self.opened = False
+
+    def sample(self, index, frame):
+        # copy every Nth frame, the buffer is reused once it is encoded
+        if index % self.every or not self.enabled:
+            return
+        try:
+            self.queue.put_nowait(frame.copy())
+        except queue.Full:
+            pass
+
+    def update(self):
+        # draw the waiting sample and keep the window responsive
+        if not self.enabled:
+            return
+        try:
+            try:
+                frame = self.queue.get_nowait()
+            except queue.Empty:
+                frame = None
+            if frame is not None:
+                cv2.imshow(self.window, np.hstack((self.base_image, frame)))
+                self.opened = True
+            if self.opened and cv2.waitKey(1) & 0xFF == ord('q'):
+                self.quit = True
+        except cv2.error as error:
+            # no display available, keep rendering without a preview
+            print(f"Preview disabled: {error}")
+            self.enabled = False
+
+    def close(self):
+        if self.opened:
+            cv2.destroyAllWindows()
+            self.opened = False
+
+def create_sky_mask(image, lower_blue=(90, 50, 120), upper_blue=(130, 255, 255)):
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    lower_blue = np.array([90, 50, 120])
-    upper_blue = np.array([130, 255, 255])
+    lower_blue = np.array(lower_blue)
+    upper_blue = np.array(upper_blue)
     mask = cv2.inRange(hsv, lower_blue, upper_blue)
     return mask
 
-def create_landmark_mask(image):
+def create_landmark_mask(image, blur_size=5, canny_thresholds=(50, 150), kernel_size=5, iterations=2):
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    edges = cv2.Canny(blur, 50, 150)
+    blur = cv2.GaussianBlur(gray, (blur_size, blur_size), 0)
+    edges = cv2.Canny(blur, *canny_thresholds)
     contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
     mask = np.zeros_like(gray)
     cv2.drawContours(mask, contours, -1, (255), thickness=cv2.FILLED)
     
-    kernel = np.ones((5, 5), np.uint8)
-    mask = cv2.dilate(mask, kernel, iterations=2)
+    kernel = np.ones((kernel_size, kernel_size), np.uint8)
+    mask = cv2.dilate(mask, kernel, iterations=iterations)
     
     return mask
 
@@ -49,7 +248,270 @@ def create_exclusion_zone_mask(image):
     cv2.rectangle(mask, (int(w*0.65), int(h*0.3)), (w, h), (255), thickness=cv2.FILLED)  # Middle right exclusion zone
     return mask
 
-def overlay_frames_on_image(image_path, frames, output_path, traveler_image_path, opacity=0.5):
+# thresholds and kernel sizes used for the masks, change them per base image through mask_params
+MASK_PARAMS = {
+    'lower_blue': (90, 50, 120),
+    'upper_blue': (130, 255, 255),
+    'blur_size': 5,
+    'canny_thresholds': (50, 150),
+    'kernel_size': 5,
+    'iterations': 2
+}
+
+# bump this to ignore masks cached by an older version
+MASK_CACHE_VERSION = 1
+
+MASK_CACHE_DIR = cache_folder('.mask_cache')
+
+def create_combined_mask(image, mask_params=None):
+    """
+    Mask of the sky pixels meteors can be blended into: sky, minus the
+    landmark, minus the exclusion zones.
+
+    :param image: BGR base image.
+    :param mask_params: Dictionary overriding entries of MASK_PARAMS.
+    """
+    params = dict(MASK_PARAMS, **(mask_params or {}))
+
+    sky_mask = create_sky_mask(image, params['lower_blue'], params['upper_blue'])
+    landmark_mask = create_landmark_mask(image, params['blur_size'], params['canny_thresholds'], params['kernel_size'], params['iterations'])
+    landmark_mask = refine_landmark_mask(landmark_mask)
+    
+    exclusion_zone_mask = create_exclusion_zone_mask(image)
+    
+    combined_mask = cv2.bitwise_and(sky_mask, cv2.bitwise_not(landmark_mask))
+    combined_mask = cv2.bitwise_and(combined_mask, cv2.bitwise_not(exclusion_zone_mask))
+    return combined_mask
+
+def mask_key(image_bytes, mask_params=None):
+    """
+    Cache key of a combined mask: the image content, the mask parameters,
+    the code of the mask functions and the cache version.
+    """
+    params = dict(MASK_PARAMS, **(mask_params or {}))
+    digest = hashlib.sha256(b'v%d' % MASK_CACHE_VERSION)
+    digest.update(image_bytes)
+    digest.update(repr(sorted(params.items())).encode())
+    for function in (create_sky_mask, create_landmark_mask, refine_landmark_mask, create_exclusion_zone_mask, create_combined_mask):
+        digest.update(inspect.getsource(function).encode())
+    return digest.hexdigest()
+
+def load_combined_mask(image_path, mask_params=None, cache_dir=MASK_CACHE_DIR):
+    """
+    create_combined_mask for an image file, reusing the mask from an
+    earlier run when the image and parameters are the same.
+
+    :param image_path: Path of the base image.
+    :param mask_params: Dictionary overriding entries of MASK_PARAMS.
+    :param cache_dir: Folder for the cached masks, None disables the cache.
+    :return: The mask, or None when the image cannot be read.
+    """
+    with open(image_path, 'rb') as file:
+        image_bytes = file.read()
+
+    def compute():
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        return create_combined_mask(image, mask_params)
+
+    if cache_dir is None:
+        return compute()
+    return cached(mask_key(image_bytes, mask_params), cache_dir, lambda path: cv2.imread(path, cv2.IMREAD_GRAYSCALE),
+                  lambda mask, path: cv2.imwrite(path, mask), compute, '.png')
+
+def _cache_mask(image_path, mask_params, cache_dir):
+    # runs in a worker process, the mask is read back from the cache by the caller
+    load_combined_mask(image_path, mask_params, cache_dir)
+
+def load_combined_masks(image_dir, mask_params=None, cache_dir=MASK_CACHE_DIR, workers=None):
+    """
+    Combined masks for every image in a folder, computing the ones that are
+    not cached yet on a process pool.
+
+    :param image_dir: Folder of base images.
+    :param mask_params: Dictionary overriding entries of MASK_PARAMS.
+    :param cache_dir: Folder for the cached masks.
+    :param workers: Number of worker processes, None uses every core.
+    :return: Dictionary of image path to mask.
+    """
+    image_paths = [os.path.join(image_dir, f) for f in sorted(os.listdir(image_dir)) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+
+    # only start workers for the images that have no cached mask yet
+    missing = []
+    for image_path in image_paths:
+        with open(image_path, 'rb') as file:
+            key = mask_key(file.read(), mask_params)
+        if not os.path.exists(cache_path(cache_dir, key, '.png')):
+            missing.append(image_path)
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_cache_mask, missing, [mask_params] * len(missing), [cache_dir] * len(missing)))
+
+    return {image_path: load_combined_mask(image_path, mask_params, cache_dir) for image_path in image_paths}
+
+def build_overlay_plan(base_image, combined_mask, traveler_image, opacity=0.5):
+    """
+    Work out everything in the per frame composite that does not change
+    between frames, so each frame only has to blend the meteor and the
+    traveler into an output buffer.
+
+    :param base_image: BGR base image.
+    :param combined_mask: Mask of the sky pixels the meteors are blended into.
+    :param traveler_image: BGRA traveler image, already resized.
+    :param opacity: Opacity of the meteor frames.
+    :return: Plan dictionary for composite_frame and composite_sky.
+    """
+    HEIGHT, WIDTH = base_image.shape[:2]
+
+    # Calculate the position where the traveler image will be placed
+    traveler_y_start = HEIGHT - traveler_image.shape[0] - 50
+    traveler_y_end = traveler_y_start + traveler_image.shape[0]
+
+    # Move the traveler to the bottom middle with an offset to the left
+    traveler_x_start = (WIDTH - traveler_image.shape[1]) // 2 - 180
+    traveler_x_end = traveler_x_start + traveler_image.shape[1]
+
+    # Ensure the traveler image fits within the final frame
+    traveler_y_end = min(traveler_y_end, HEIGHT)
+    traveler_x_end = min(traveler_x_end, WIDTH)
+
+    # Calculate the correct slicing dimensions
+    traveler_slice_y_end = traveler_y_end - traveler_y_start
+    traveler_slice_x_end = traveler_x_end - traveler_x_start
+
+    plan = {
+        'base': base_image,
+        'mask': combined_mask,
+        'opacity': opacity,
+        'meteor': np.zeros_like(base_image),  # stays zero outside the mask, bitwise_and only writes under it
+        'traveler_region': (slice(traveler_y_start, traveler_y_end), slice(traveler_x_start, traveler_x_end)),
+        'traveler_position': (traveler_x_start, traveler_y_start),
+        'traveler': prepare_sprite(traveler_image[:traveler_slice_y_end, :traveler_slice_x_end], 3)
+    }
+
+    # every pixel outside the sky is the same in every frame
+    plan['static'] = base_image.copy()
+    _blend_traveler(plan, plan['static'])
+
+    # the sky pixels as flat indices into the frame
+    plan['sky_pixels'] = np.flatnonzero(combined_mask)
+    plan['sky_base'] = base_image.reshape(-1, 3)[plan['sky_pixels']]
+    plan['sky_blend'] = np.empty_like(plan['sky_base'])
+
+    # the traveler has to be blended again every frame if it covers any sky
+    traveler_mask = combined_mask[plan['traveler_region']]
+    plan['traveler_over_sky'] = bool(traveler_mask.any())
+
+    return plan
+
+def _blend_traveler(plan, out):
+    # Overlay the traveler image on the final frame
+    blend_sprite(out, plan['traveler'], *plan['traveler_position'])
+
+def composite_frame(plan, resized_frame, out):
+    """
+    Composite one meteor frame, already resized to the base image, into out.
+    """
+    # the meteor is added on the sky only, everywhere else the base image shows through
+    meteor_overlay = cv2.bitwise_and(resized_frame, resized_frame, dst=plan['meteor'], mask=plan['mask'])
+    cv2.addWeighted(plan['base'], 1, meteor_overlay, plan['opacity'], 0, dst=out)
+    _blend_traveler(plan, out)
+    return out
+
+# one BGR pixel as a single 3 byte element, so gathers and scatters move whole pixels
+_PIXEL = np.dtype((np.void, 3))
+
+def _pixels(image):
+    # flat view of a contiguous BGR image with one element per pixel
+    if not image.flags.c_contiguous:
+        raise ValueError("image must be a contiguous array")
+    return image.view(_PIXEL).reshape(-1)
+
+def composite_sky(plan, frame, out):
+    """
+    Composite one meteor frame into out, touching only the sky pixels.
+
+    Only the pixels under the mask are blended and scattered into out.
+    out must already hold plan['static'] everywhere else, which stays true
+    for a buffer reused from an earlier frame.
+
+    :param plan: Plan from build_overlay_plan.
+    :param frame: Meteor frame, already resized to the base image.
+    :param out: Output frame, modified in place.
+    """
+    if len(plan['sky_pixels']) == 0:
+        return out
+
+    if plan['traveler_over_sky']:
+        # the traveler is blended again on top of this frame's sky
+        out[plan['traveler_region']] = plan['base'][plan['traveler_region']]
+
+    meteor_pixels = np.take(_pixels(np.ascontiguousarray(frame)), plan['sky_pixels'])
+    meteor_pixels = meteor_pixels.view(np.uint8).reshape(-1, 3)
+    blend = cv2.addWeighted(plan['sky_base'], 1, meteor_pixels, plan['opacity'], 0, dst=plan['sky_blend'])
+    np.put(_pixels(out), plan['sky_pixels'], _pixels(blend))
+
+    if plan['traveler_over_sky']:
+        _blend_traveler(plan, out)
+    return out
+
+def open_outputs(outputs, size, fps=30.0, queue_size=8):
+    """
+    Open one BackgroundWriter per output, each encoding on its own thread.
+
+    :param outputs: Output path, or a list of output specs. A spec is a
+                    path or a dictionary with 'path' and optionally 'size' as
+                    (width, height), 'fourcc' as a four letter string and
+                    'fps'. Missing entries default to the composite size,
+                    'mp4v' and fps.
+    :param size: (width, height) of the composited frames.
+    :param fps: Frame rate of the composited frames.
+    :return: List of (writer, rate) pairs, rate is the fraction of frames
+             the output keeps.
+    """
+    if isinstance(outputs, str):
+        outputs = [outputs]
+
+    writers = []
+    try:
+        for spec in outputs:
+            if isinstance(spec, str):
+                spec = {'path': spec}
+            elif not isinstance(spec, dict):
+                raise TypeError("output spec must be a path or a dictionary, not %s" % type(spec).__name__)
+            output_size = tuple(spec.get('size', size))
+            output_fps = spec.get('fps', fps)
+            fourcc = cv2.VideoWriter_fourcc(*spec.get('fourcc', 'mp4v'))
+            writer = cv2.VideoWriter(spec['path'], fourcc, output_fps, output_size)
+            resize = output_size if output_size != tuple(size) else None
+            writers.append((BackgroundWriter(writer, queue_size, resize), min(output_fps / fps, 1.0)))
+    except Exception:
+        release_outputs(writers)
+        raise
+    return writers
+
+def release_outputs(writers):
+    # release every writer, then raise the first error any of them hit
+    errors = []
+    for writer, _ in writers:
+        try:
+            writer.release()
+        except Exception as error:
+            errors.append(error)
+    if errors:
+        raise errors[0]
+
+def overlay_frames_on_image(image_path, frames, output_path, traveler_image_path, opacity=0.5, queue_size=8, sky_only=True, preview_every=None, mask_params=None, resize_workers=2, fps=30.0):
+    """
+    Composite a meteor clip onto a base image and write it out.
+
+    :param output_path: Output path, or a list of output specs for several
+                        renditions, see open_outputs. Frames are decoded,
+                        masked and blended once however many outputs there are.
+    :param fps: Frame rate of the composite. Outputs with a lower fps keep
+                an evenly spread subset of the frames.
+    """
     base_image = cv2.imread(image_path)
     if base_image is None:
         print(f"Error: Couldn't open base image file at {image_path}")
@@ -59,75 +521,63 @@ def overlay_frames_on_image(image_path, frames, output_path, traveler_image_path
     traveler_image = cv2.imread(traveler_image_path, cv2.IMREAD_UNCHANGED)
     traveler_image_resized = cv2.resize(traveler_image, (200, 200), interpolation=cv2.INTER_AREA)
 
-    sky_mask = create_sky_mask(base_image)
-    landmark_mask = create_landmark_mask(base_image)
-    landmark_mask = refine_landmark_mask(landmark_mask)
-    
-    exclusion_zone_mask = create_exclusion_zone_mask(base_image)
-    
-    combined_mask = cv2.bitwise_and(sky_mask, cv2.bitwise_not(landmark_mask))
-    combined_mask = cv2.bitwise_and(combined_mask, cv2.bitwise_not(exclusion_zone_mask))
+    # masks are cached, so compositing onto the same photo again skips this
+    combined_mask = load_combined_mask(image_path, mask_params)
 
     WIDTH, HEIGHT = base_image.shape[1], base_image.shape[0]
+    plan = build_overlay_plan(base_image, combined_mask, traveler_image_resized, opacity)
 
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, 30.0, (WIDTH, HEIGHT))
-
-    for frame in frames:
-        resized_frame = resize_frame(frame, (WIDTH, HEIGHT))
-        
-        meteor_overlay = cv2.bitwise_and(resized_frame, resized_frame, mask=combined_mask)
-        
-        inverse_combined_mask = cv2.bitwise_not(combined_mask)
-        background = cv2.bitwise_and(base_image, base_image, mask=inverse_combined_mask)
-        
-        combined = cv2.addWeighted(base_image, 1, meteor_overlay, opacity, 0)
-        final_frame = cv2.bitwise_or(combined, background)
-        
-        # Overlay the traveler image on the final frame
-        traveler_alpha_channel = traveler_image_resized[:, :, 3] / 255.0
-        traveler_rgb_channels = traveler_image_resized[:, :, :3]
 
-        # Expand the alpha channel to match the dimensions of the RGB channels
-        traveler_alpha_channel = np.repeat(traveler_alpha_channel[:, :, np.newaxis], 3, axis=2)
+    outputs = open_outputs(output_path, (WIDTH, HEIGHT), fps, queue_size)
 
-        # Calculate the position where the traveler image will be placed
-        traveler_y_start = HEIGHT - traveler_image_resized.shape[0] - 50
-        traveler_y_end = traveler_y_start + traveler_image_resized.shape[0]
-        
-        # Move the traveler to the bottom middle with an offset to the left
-        traveler_x_start = (WIDTH - traveler_image_resized.shape[1]) // 2 - 180
-        traveler_x_end = traveler_x_start + traveler_image_resized.shape[1]
+    # output buffers are reused, one for every frame that can be queued or
+    # encoding at once plus the one being composited. An output that keeps
+    # only every Nth frame holds on to its frames N times as long, so the
+    # slowest rate sets the size. They start out as the static frame, so
+    # sky_only only has to write the sky pixels
+    min_rate = min([rate for _, rate in outputs if rate > 0], default=1.0)
+    buffers = [plan['static'].copy() for _ in range((queue_size + 1) * math.ceil(1 / min_rate) + 1)]
 
-        # Ensure the traveler image fits within the final frame
-        traveler_y_end = min(traveler_y_end, HEIGHT)
-        traveler_x_end = min(traveler_x_end, WIDTH)
-        
-        # Calculate the correct slicing dimensions
-        traveler_slice_y_end = traveler_y_end - traveler_y_start
-        traveler_slice_x_end = traveler_x_end - traveler_x_start
+    # no windows unless a preview is asked for, so this also runs without a display
+    preview = ComparisonPreview(base_image, preview_every) if preview_every else None
 
-        final_frame[traveler_y_start:traveler_y_end, traveler_x_start:traveler_x_end] = \
-            final_frame[traveler_y_start:traveler_y_end, traveler_x_start:traveler_x_end] * (1 - traveler_alpha_channel[:traveler_slice_y_end, :traveler_slice_x_end]) + \
-            traveler_rgb_channels[:traveler_slice_y_end, :traveler_slice_x_end] * traveler_alpha_channel[:traveler_slice_y_end, :traveler_slice_x_end]
-        
-        out.write(final_frame)
+    # frames are decoded, resized and encoded on their own threads while this one composites
+    try:
+        resized_frames = resize_frames(prefetch(frames, queue_size), (WIDTH, HEIGHT), resize_workers, queue_size)
+        for index, resized_frame in enumerate(resized_frames):
+            if sky_only:
+                final_frame = composite_sky(plan, resized_frame, buffers[index % len(buffers)])
+            else:
+                final_frame = composite_frame(plan, resized_frame, buffers[index % len(buffers)])
         
-        # Optional: Display the comparison frame
-        comparison_frame = np.hstack((base_image, final_frame))
-        cv2.imshow('Comparison Frame', comparison_frame)
+            # every output gets the same buffer, each resizes it on its own encode thread
+            for out, rate in outputs:
+                if int((index + 1) * rate) > int(index * rate):
+                    out.write(final_frame)
         
-        if cv2.waitKey(30) & 0xFF == ord('q'):
-            break
+            # Optional: Display the comparison frame
+            if preview is not None:
+                preview.sample(index, final_frame)
+                preview.update()
+                if preview.quit:
+                    break
+    finally:
+        if preview is not None:
+            preview.close()
+        release_outputs(outputs)
 
-    out.release()
-    cv2.destroyAllWindows()
+if __name__ == '__main__':
+    # Example usage
+    video_path = 'meteor_source.mp4'
+    image_path = 'Great_Wall_night.jpg'
+    output_path = [
+        {'path': 'greatwall_meteor.mp4'},  # full resolution master
+        # {'path': 'greatwall_meteor_720p.mp4', 'size': (1080, 720)},  # web copy
+        # {'path': 'greatwall_meteor_preview.mp4', 'size': (480, 320), 'fps': 15}  # low res preview
+    ]
+    traveler_image_path = 'traveller_no_bg.png'
 
-# Example usage
-video_path = 'meteor_source.mp4'
-image_path = 'Great_Wall_night.jpg'
-output_path = 'greatwall_meteor.mp4'
-traveler_image_path = 'traveller_no_bg.png'
+    preview_every = None  # e.g. 10 shows every 10th frame, None renders without opening a window
 
-frames = extract_frames(video_path)
-overlay_frames_on_image(image_path, frames, output_path, traveler_image_path)
\ No newline at end of file
+    frames = extract_frames(video_path)
+    overlay_frames_on_image(image_path, frames, output_path, traveler_image_path, preview_every=preview_every)
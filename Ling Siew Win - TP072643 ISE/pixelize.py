@@ -0,0 +1,154 @@
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import numpy as np
+import os
+
+def _block_sums(region, block_height, block_width):
+    # sum the rows of every block first, then the columns of the much smaller result
+    height, width, channels = region.shape
+    rows = region.reshape(height // block_height, block_height, width, channels).sum(axis=1, dtype=np.uint32)
+    return rows.reshape(height // block_height, width // block_width, block_width, channels).sum(axis=2)
+
+def _reduce_blocks(region, block_height, block_width, method):
+    # reduce every block_height x block_width block of region to one pixel
+    height, width, channels = region.shape
+
+    if method == 'median':
+        blocks = region.reshape(height // block_height, block_height, width // block_width, block_width, channels)
+        blocks = blocks.transpose(0, 2, 1, 3, 4).reshape(height // block_height, width // block_width, -1, channels)
+        return np.median(blocks, axis=2)
+
+    count = block_height * block_width
+    if channels == 4:
+        # weight the colours by alpha so transparent pixels do not darken the edges
+        alpha = region[:, :, 3:]
+        alpha_sum = _block_sums(alpha, block_height, block_width)
+        color_sum = _block_sums(region[:, :, :3] * alpha.astype(np.uint16), block_height, block_width)
+        color = np.divide(color_sum, alpha_sum, out=np.zeros(color_sum.shape), where=alpha_sum > 0)
+        return np.concatenate([color, alpha_sum / count], axis=-1)
+
+    return _block_sums(region, block_height, block_width) / count
+
+def _quantize(blocks, colors):
+    # map the block colours onto a palette of at most colors entries
+    image = Image.fromarray(blocks)
+    quantized = image.quantize(colors, method=Image.Quantize.FASTOCTREE)
+    return np.asarray(quantized.convert(image.mode))
+
+def full_scale(image):
+    """
+    Value white is stored as in a 32 bit integer or float PIL image: 1 when
+    a float image stays within 0-1, 255 when the values stay within 0-255
+    and 65535 otherwise. I;16 images are always 65535.
+    """
+    if image.mode.startswith('I;16'):
+        return 65535
+    top = image.getextrema()[1]
+    if image.mode == 'F' and top <= 1:
+        return 1.0
+    return 255 if top <= 255 else 65535
+
+def to_8bit(image, scale=None):
+    """
+    Convert a PIL image to a mode pixelize can average: L, RGB or RGBA.
+
+    Palette images become RGB, or RGBA when they have transparency, so the
+    colours are averaged instead of the palette indices. 16 bit images are
+    scaled down to 8 bits instead of being clipped at 255. 32 bit integer
+    and float images are scaled by the range their values are in: 0-1
+    floats and values up to 255 are taken as 8 bit, anything larger as 16
+    bit.
+
+    :param scale: full_scale of the image, pass the one of the whole image
+                  when converting parts of it (optional).
+    """
+    if image.mode in ('L', 'RGB', 'RGBA'):
+        return image
+    if image.mode.startswith('I') or image.mode == 'F':
+        if scale is None:
+            scale = full_scale(image)
+        pixels = np.asarray(image)
+        if scale != 255:
+            pixels = pixels * (255 / scale)
+        return Image.fromarray(np.clip(np.round(pixels), 0, 255).astype(np.uint8))
+    if image.mode == '1':
+        return image.convert('L')
+    if image.mode in ('LA', 'La', 'PA', 'RGBa') or 'transparency' in image.info:
+        return image.convert('RGBA')
+    return image.convert('RGB')
+
+def pixelize(image, pixel_size, method='mean', colors=None):
+    """
+    Pixelize an 8 bit image by reducing every pixel_size x pixel_size block
+    to one colour.
+
+    The image is viewed as (H/b, b, W/b, b, C) blocks, so the full blocks
+    are reduced without copying the image. Blocks along the right and
+    bottom edges that are cut short are reduced over the pixels they have.
+
+    :param image: PIL image in any mode, converted with to_8bit, or uint8
+                  array, gray, RGB or RGBA.
+    :param pixel_size: Block size in pixels.
+    :param method: 'mean' or 'median'. For RGBA the mean weights colours by
+                   alpha.
+    :param colors: Number of palette colours to quantize the blocks to
+                   (optional).
+    :return: Pixelized uint8 array with the same shape as the image.
+    """
+    if method not in ('mean', 'median'):
+        raise ValueError("method must be 'mean' or 'median'")
+    if pixel_size < 1:
+        raise ValueError("pixel_size must be at least 1")
+
+    if isinstance(image, Image.Image):
+        image = to_8bit(image)
+    pixels = np.asarray(image)
+    gray = pixels.ndim == 2
+    if gray:
+        pixels = pixels[:, :, np.newaxis]
+    height, width, channels = pixels.shape
+    block_rows, block_cols = -(-height // pixel_size), -(-width // pixel_size)
+    full_height, full_width = height - height % pixel_size, width - width % pixel_size
+
+    # one colour per block, full blocks first and then the short edge blocks
+    blocks = np.empty((block_rows, block_cols, channels))
+    full_rows, full_cols = full_height // pixel_size, full_width // pixel_size
+    blocks[:full_rows, :full_cols] = _reduce_blocks(pixels[:full_height, :full_width], pixel_size, pixel_size, method)
+    if full_width < width:
+        blocks[:full_rows, full_cols:] = _reduce_blocks(pixels[:full_height, full_width:], pixel_size, width - full_width, method)
+    if full_height < height:
+        blocks[full_rows:, :full_cols] = _reduce_blocks(pixels[full_height:, :full_width], height - full_height, pixel_size, method)
+    if full_height < height and full_width < width:
+        blocks[full_rows:, full_cols:] = _reduce_blocks(pixels[full_height:, full_width:], height - full_height, width - full_width, method)
+    blocks = np.clip(np.round(blocks), 0, 255).astype(np.uint8)
+
+    if colors is not None:
+        blocks = _quantize(blocks[:, :, 0] if gray else blocks, colors).reshape(blocks.shape)
+
+    # every block colour repeated over its block, cropped back to the image size
+    pixelized = np.repeat(np.repeat(blocks, pixel_size, axis=1)[:, :width], pixel_size, axis=0)[:height]
+    return pixelized[:, :, 0] if gray else pixelized
+
+def _pixelize_file(input_path, output_path, pixel_size, method, colors):
+    # runs in a worker process
+    with Image.open(input_path) as image:
+        pixelized = pixelize(image, pixel_size, method, colors)
+    Image.fromarray(pixelized).save(output_path)
+    return output_path
+
+def pixelize_directory(input_dir, output_dir, pixel_size, method='mean', colors=None, workers=None):
+    """
+    Pixelize every image in a folder on a process pool.
+
+    :param input_dir: Folder of images.
+    :param output_dir: Folder for the pixelized images, same file names.
+    :param workers: Number of worker processes, None uses every core.
+    :return: List of written paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    names = [f for f in sorted(os.listdir(input_dir)) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    input_paths = [os.path.join(input_dir, name) for name in names]
+    output_paths = [os.path.join(output_dir, name) for name in names]
+    count = len(names)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_pixelize_file, input_paths, output_paths, [pixel_size] * count, [method] * count, [colors] * count))
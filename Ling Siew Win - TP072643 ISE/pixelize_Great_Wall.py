@@ -1,82 +1,59 @@
 from PIL import Image, ImageEnhance
+from functools import partial
 import numpy as np
 import matplotlib.pyplot as plt
-from rembg import remove
+
+from background_removal import remove_backgrounds
+from sprite_blend import prepare_sprite, blend_sprite
+from pixelize import pixelize
+from histograms import channel_histograms, draw_histogram, histogram_image
+from pixelize_strips import open_source, source_size, pixelize_in_strips
+from previews import make_preview, load_preview
 
 def enhance_color(image, enhancement_factor):
     # Enhance the color of the image
     enhancer = ImageEnhance.Color(image)
     return enhancer.enhance(enhancement_factor)
 
-def plot_color_histograms(original_image, enhanced_image):
-    # Convert images to numpy arrays
-    original_np = np.array(original_image)
-    enhanced_np = np.array(enhanced_image)
-    
-    # Flatten the image arrays and separate color channels
-    r_orig, g_orig, b_orig = original_np[..., 0].flatten(), original_np[..., 1].flatten(), original_np[..., 2].flatten()
-    r_enh, g_enh, b_enh = enhanced_np[..., 0].flatten(), enhanced_np[..., 1].flatten(), enhanced_np[..., 2].flatten()
-    
-    # Plot histograms for each channel
+def plot_color_histograms(original_image, enhanced_image, style='step'):
+    # Count every channel of both images in one pass each, cached per image
+    original_counts = channel_histograms(original_image)
+    enhanced_counts = channel_histograms(enhanced_image)
+    
+    histograms = [original_counts[0], original_counts[1], original_counts[2], enhanced_counts[0], enhanced_counts[1], enhanced_counts[2]]
+    colors = ['red', 'green', 'blue', 'red', 'green', 'blue']
+    titles = ['Original Red Channel', 'Original Green Channel', 'Original Blue Channel',
+              'Enhanced Red Channel', 'Enhanced Green Channel', 'Enhanced Blue Channel']
+    
+    # Draw all six histograms as one image
+    if style == 'image':
+        plt.figure(figsize=(14, 5))
+        plt.imshow(histogram_image(histograms, colors))
+        plt.axis('off')
+        plt.title('Original (top) and Enhanced (bottom) Red, Green and Blue Channels')
+        plt.tight_layout()
+        return
+    
+    # Plot histograms for each channel as step outlines
     plt.figure(figsize=(14, 10))
-    
-    # Original Image Histograms
-    plt.subplot(2, 3, 1)
-    plt.hist(r_orig, bins=256, color='red', alpha=0.6)
-    plt.title('Original Red Channel')
-    
-    plt.subplot(2, 3, 2)
-    plt.hist(g_orig, bins=256, color='green', alpha=0.6)
-    plt.title('Original Green Channel')
-    
-    plt.subplot(2, 3, 3)
-    plt.hist(b_orig, bins=256, color='blue', alpha=0.6)
-    plt.title('Original Blue Channel')
-    
-    # Enhanced Image Histograms
-    plt.subplot(2, 3, 4)
-    plt.hist(r_enh, bins=256, color='red', alpha=0.6)
-    plt.title('Enhanced Red Channel')
-    
-    plt.subplot(2, 3, 5)
-    plt.hist(g_enh, bins=256, color='green', alpha=0.6)
-    plt.title('Enhanced Green Channel')
-    
-    plt.subplot(2, 3, 6)
-    plt.hist(b_enh, bins=256, color='blue', alpha=0.6)
-    plt.title('Enhanced Blue Channel')
+    for i, (counts, color, title) in enumerate(zip(histograms, colors, titles)):
+        plt.subplot(2, 3, i + 1)
+        draw_histogram(plt.gca(), counts, color)
+        plt.title(title)
     
     plt.tight_layout()
 
-def pixelize_and_display_images(input_image_path, dragon_image_path, traveller_image_path, pixel_size, color_enhancement_factor, dragon_resize_factor, traveller_resize_factor):
-    # Open the original image
-    original_image = Image.open(input_image_path)
-    
-    # Enhance the color of the original image
-    enhanced_image = enhance_color(original_image, color_enhancement_factor)
-    
-    # Pixelize the enhanced image
-    pixelized_image = enhanced_image.resize(
-        (enhanced_image.width // pixel_size, enhanced_image.height // pixel_size),
-        resample=Image.Resampling.NEAREST
-    )
-    pixelized_image = pixelized_image.resize(
-        (pixelized_image.width * pixel_size, pixelized_image.height * pixel_size),
-        resample=Image.Resampling.NEAREST
-    )
-
-    # Remove the background from the dragon image
+def load_sprites(dragon_image_path, traveller_image_path, pixel_size, dragon_resize_factor, traveller_resize_factor):
+    # Remove the background from the dragon and traveller images in one batch,
+    # the model is loaded once and cutouts of unchanged images come from the cache
     dragon_image = Image.open(dragon_image_path).convert("RGBA")
-    dragon_no_bg = remove(dragon_image)
+    traveller_image = Image.open(traveller_image_path).convert("RGBA")
+    dragon_no_bg, traveller_no_bg = remove_backgrounds([dragon_image, traveller_image])
 
     # Resize the dragon image to be larger based on the resize factor
     dragon_size = (int(dragon_no_bg.width * dragon_resize_factor), int(dragon_no_bg.height * dragon_resize_factor))
     resized_dragon = dragon_no_bg.resize(dragon_size, Image.Resampling.LANCZOS)
 
-    # Remove the background from the traveller image
-    traveller_image = Image.open(traveller_image_path).convert("RGBA")
-    traveller_no_bg = remove(traveller_image)
-
     # Save the background-removed traveller image as a PNG file
     traveller_no_bg.save('traveller_no_bg.png')
     
@@ -84,73 +61,134 @@ def pixelize_and_display_images(input_image_path, dragon_image_path, traveller_i
     traveller_size = (int(traveller_no_bg.width * traveller_resize_factor), int(traveller_no_bg.height * traveller_resize_factor))
     resized_traveller = traveller_no_bg.resize(traveller_size, Image.Resampling.LANCZOS)
 
-    # Pixelize the traveller image
-    pixelized_traveller = resized_traveller.resize(
-        (resized_traveller.width // pixel_size, resized_traveller.height // pixel_size),
-        resample=Image.Resampling.NEAREST
-    )
-    pixelized_traveller = pixelized_traveller.resize(
-        (pixelized_traveller.width * pixel_size, pixelized_traveller.height * pixel_size),
-        resample=Image.Resampling.NEAREST
-    )
-
-    # Create the final image with the background-removed dragon and traveller overlaid on the pixelized image
-    position_dragon = (pixelized_image.width - resized_dragon.width - 50, pixelized_image.height // 2 - resized_dragon.height - 100)
-    final_image = pixelized_image.copy()
-    final_image.paste(resized_dragon, position_dragon, resized_dragon)
+    # Pixelize the traveller image, colours are weighted by alpha so the edges stay clean
+    pixelized_traveller = Image.fromarray(pixelize(resized_traveller, pixel_size))
+
+    return {
+        'dragon_image': dragon_image,
+        'dragon_no_bg': dragon_no_bg,
+        'resized_dragon': resized_dragon,
+        'traveller_image': traveller_image,
+        'traveller_no_bg': traveller_no_bg,
+        'pixelized_traveller': pixelized_traveller
+    }
+
+def sprite_positions(width, height, sprites, scale=1.0):
+    # Where the dragon and the traveller go on a background of the given size,
+    # the margins are scaled along with a background smaller than the source
+    resized_dragon, pixelized_traveller = sprites['resized_dragon'], sprites['pixelized_traveller']
+    position_dragon = (width - resized_dragon.width - round(50 * scale), height // 2 - resized_dragon.height - round(100 * scale))
+    position_traveller = (width // 2 - pixelized_traveller.width - round(400 * scale), height - pixelized_traveller.height - round(100 * scale))
+    return position_dragon, position_traveller
+
+def pixelize_to_file(input_image_path, dragon_image_path, traveller_image_path, output_path, pixel_size, color_enhancement_factor, dragon_resize_factor, traveller_resize_factor, strip_height=None):
+    # Same final image as pixelize_and_display_images, processed in strips for images too large for memory.
+    # output_path has to be .npy or .ppm, nothing is displayed. Memory only stays bounded when the input is
+    # .npy or .ppm too, a JPEG like Great_Wall_daytime.jpg is still decoded in full once
+    sprites = load_sprites(dragon_image_path, traveller_image_path, pixel_size, dragon_resize_factor, traveller_resize_factor)
+
+    source = open_source(input_image_path)
+    position_dragon, position_traveller = sprite_positions(*source_size(source), sprites)
+    blended_sprites = [
+        (prepare_sprite(sprites['resized_dragon'], 3), position_dragon),
+        (prepare_sprite(sprites['pixelized_traveller'], 3), position_traveller)
+    ]
+
+    enhance = partial(enhance_color, enhancement_factor=color_enhancement_factor)
+    return pixelize_in_strips(source, output_path, pixel_size, enhance, blended_sprites, strip_height)
+
+def pixelize_and_display_images(input_image_path, dragon_image_path, traveller_image_path, pixel_size, color_enhancement_factor, dragon_resize_factor, traveller_resize_factor, output_path=None, histogram_style='step'):
+    # Only an image that is saved is made at full resolution. For display alone everything is made
+    # from the cached screen sized preview, with the block size and sprites scaled to match
+    with Image.open(input_image_path) as source:
+        source_mode, source_width = source.mode, source.width
+    if output_path is None:
+        original_image = load_preview(input_image_path, mode=source_mode)
+    else:
+        original_image = Image.open(input_image_path)
+    scale = original_image.width / source_width
+    scaled_pixel_size = max(1, round(pixel_size * scale))
+    
+    # Enhance the color of the original image
+    enhanced_image = enhance_color(original_image, color_enhancement_factor)
+    
+    # Pixelize the enhanced image, every block becomes the average of its pixels
+    pixelized_image = Image.fromarray(pixelize(enhanced_image, scaled_pixel_size))
 
-    # Adjust the traveller position and paste it onto the final image
-    position_traveller = (pixelized_image.width // 2 - pixelized_traveller.width - 400, pixelized_image.height - pixelized_traveller.height - 100)
-    final_image.paste(pixelized_traveller, position_traveller, pixelized_traveller)
+    # Cut out, resize and pixelize the dragon and traveller
+    sprites = load_sprites(dragon_image_path, traveller_image_path, scaled_pixel_size, dragon_resize_factor * scale, traveller_resize_factor * scale)
+    dragon_no_bg, traveller_no_bg = sprites['dragon_no_bg'], sprites['traveller_no_bg']
 
-    # Plot histograms first
-    plot_color_histograms(original_image, enhanced_image)
+    # Create the final image with the background-removed dragon and traveller overlaid on the pixelized image
+    # blended in place with integer maths, same pixels as paste with a mask
+    position_dragon, position_traveller = sprite_positions(pixelized_image.width, pixelized_image.height, sprites, scale)
+    final_pixels = np.array(pixelized_image.convert('RGB'))
+    blend_sprite(final_pixels, prepare_sprite(sprites['resized_dragon'], 3), *position_dragon)
+    blend_sprite(final_pixels, prepare_sprite(sprites['pixelized_traveller'], 3), *position_traveller)
+    final_image = Image.fromarray(final_pixels)
+
+    # Only the saved output is full resolution
+    if output_path is not None:
+        final_image.save(output_path)
+
+    # Screen sized previews for the figure, the unchanged source images come from the preview cache
+    original_preview = load_preview(input_image_path, mode=source_mode)
+    dragon_preview = load_preview(dragon_image_path, mode='RGBA')
+    traveller_preview = load_preview(traveller_image_path, mode='RGBA')
+    enhanced_preview = make_preview(enhanced_image)
+    pixelized_preview = make_preview(pixelized_image)
+    dragon_no_bg_preview = make_preview(dragon_no_bg)
+    traveller_no_bg_preview = make_preview(traveller_no_bg)
+    final_preview = make_preview(final_image)
+
+    # Plot histograms first, of the preview scale images when nothing is saved
+    plot_color_histograms(original_image, enhanced_image, histogram_style)
     
     # Display the images
     plt.figure(figsize=(14, 10))
     
     plt.subplot(3, 3, 1)
-    plt.imshow(original_image)
+    plt.imshow(original_preview)
     plt.axis('off')
     plt.title('Original Image')
     
     plt.subplot(3, 3, 2)
-    plt.imshow(enhanced_image)
+    plt.imshow(enhanced_preview)
     plt.axis('off')
     plt.title('Enhanced Image')
     
     plt.subplot(3, 3, 3)
-    plt.imshow(pixelized_image)
+    plt.imshow(pixelized_preview)
     plt.axis('off')
     plt.title('Pixelized Enhanced Image')
 
     plt.subplot(3, 3, 4)
-    plt.imshow(dragon_image)
+    plt.imshow(dragon_preview)
     plt.axis('off')
     plt.title('Dragon Image with Background')
     
     plt.subplot(3, 3, 5)
-    plt.imshow(dragon_no_bg)
+    plt.imshow(dragon_no_bg_preview)
     plt.axis('off')
     plt.title('Dragon Image Without Background')
 
     plt.subplot(3, 3, 6)
-    plt.imshow(final_image)
+    plt.imshow(final_preview)
     plt.axis('off')
     plt.title('Final Image with Dragon (No BG)')
     
     plt.subplot(3, 3, 7)
-    plt.imshow(traveller_image)
+    plt.imshow(traveller_preview)
     plt.axis('off')
     plt.title('Traveller Image with Background')
 
     plt.subplot(3, 3, 8)
-    plt.imshow(traveller_no_bg)
+    plt.imshow(traveller_no_bg_preview)
     plt.axis('off')
     plt.title('Traveller Image Without Background')
 
     plt.subplot(3, 3, 9)
-    plt.imshow(final_image)
+    plt.imshow(final_preview)
     plt.axis('off')
     plt.title('Final Image with Traveller (No BG)')
     
@@ -0,0 +1,146 @@
+from PIL import Image
+import numpy as np
+import os
+
+from pixelize import pixelize, to_8bit, full_scale
+from sprite_blend import blend_sprite
+
+# default strip size in pixels, the strip height is rounded to whole blocks
+STRIP_PIXELS = 1 << 22
+
+def strip_rows(width, pixel_size, strip_height=None):
+    """
+    Height of the strips an image is processed in, always a multiple of
+    pixel_size so no pixelization block is split between two strips.
+
+    :param width: Image width in pixels.
+    :param strip_height: Requested height, rounded up to whole blocks. None
+                         picks a height of about STRIP_PIXELS pixels.
+    """
+    if strip_height is None:
+        strip_height = STRIP_PIXELS // max(width, 1)
+    return max(1, -(-strip_height // pixel_size)) * pixel_size
+
+def open_source(image):
+    """
+    Open an image for reading strip by strip.
+
+    Memory only stays bounded by the strip size for sources that can be
+    read in parts: .npy files are memory mapped, and PIL memory maps
+    uncompressed formats such as PPM. Compressed formats such as JPEG and
+    PNG cannot be decoded in strips, so the first read decodes the whole
+    image once and it stays in memory. Convert very large inputs to .npy
+    or .ppm first.
+
+    :param image: Path, PIL image or RGB uint8 array.
+    :return: Array or PIL image for read_strip.
+    """
+    if isinstance(image, (str, os.PathLike)):
+        if os.fspath(image).lower().endswith('.npy'):
+            return np.load(image, mmap_mode='r')
+        # the images streamed here are meant to be huge, so lift PIL's decompression bomb check
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            image = Image.open(image)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+    return image
+
+def source_size(source):
+    # (width, height) of an opened source
+    if isinstance(source, Image.Image):
+        return source.size
+    return source.shape[1], source.shape[0]
+
+def source_scale(source):
+    # full_scale of a 32 bit integer or float source, so every strip is scaled the same
+    if isinstance(source, Image.Image) and (source.mode.startswith('I') or source.mode == 'F'):
+        return full_scale(source)
+    return None
+
+def read_strip(source, top, bottom, scale=None):
+    # rows top to bottom of an opened source as an RGB uint8 array, converted one strip at a time
+    if isinstance(source, Image.Image):
+        strip = source.crop((0, top, source.width, bottom))
+        if strip.mode != 'RGB':
+            strip = to_8bit(strip, scale).convert('RGB')
+        return np.asarray(strip)
+    return np.asarray(source[top:bottom])
+
+class StripWriter:
+    """
+    Writes an image strip by strip without holding it in memory.
+
+    .npy outputs are memory mapped and flushed after every strip. .ppm
+    outputs are encoded as they come, the header is written up front.
+    """
+    def __init__(self, path, width, height, channels=3):
+        self.rows = 0
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.npy':
+            self.output = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(height, width, channels))
+            self.file = None
+        elif extension in ('.ppm', '.pnm'):
+            if channels != 3:
+                raise ValueError("PPM output has to be RGB")
+            self.output = None
+            self.file = open(path, 'wb')
+            self.file.write(b'P6\n%d %d\n255\n' % (width, height))
+        else:
+            raise ValueError("streamed output has to be .npy or .ppm, not %r" % extension)
+
+    def write(self, strip):
+        if self.file is not None:
+            self.file.write(np.ascontiguousarray(strip).data)
+        else:
+            self.output[self.rows:self.rows + len(strip)] = strip
+            self.output.flush()
+        self.rows += len(strip)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.output = None
+
+def pixelize_in_strips(image, output_path, pixel_size, enhance=None, sprites=(), strip_height=None, method='mean'):
+    """
+    Enhance, pixelize and blend sprites onto an image one horizontal strip
+    at a time, so memory use is bounded by the strip size instead of the
+    image size.
+
+    Colour enhancement works pixel by pixel and strips hold whole blocks,
+    so the output is the same as processing the full image at once.
+    Memory is only bounded for .npy and uncompressed sources, see
+    open_source.
+
+    :param image: Path, PIL image or array, see open_source.
+    :param output_path: .npy or .ppm file, see StripWriter.
+    :param pixel_size: Block size of the pixelization.
+    :param enhance: Function taking and returning a PIL image, applied to
+                    every strip before pixelizing (optional).
+    :param sprites: List of (sprite from prepare_sprite, (x, y)) blended
+                    onto the pixelized image in order.
+    :param strip_height: Rows per strip, see strip_rows.
+    :param method: 'mean' or 'median', see pixelize.
+    :return: The output path.
+    """
+    source = open_source(image)
+    width, height = source_size(source)
+    rows = strip_rows(width, pixel_size, strip_height)
+    scale = source_scale(source)
+
+    writer = StripWriter(output_path, width, height)
+    try:
+        for top in range(0, height, rows):
+            strip = read_strip(source, top, min(top + rows, height), scale)
+            if enhance is not None:
+                strip = np.asarray(enhance(Image.fromarray(strip)))
+            strip = pixelize(strip, pixel_size, method)
+            # sprites are clipped to the strip, y is moved into strip coordinates
+            for sprite, (x, y) in sprites:
+                blend_sprite(strip, sprite, x, y - top)
+            writer.write(strip)
+    finally:
+        writer.close()
+    return output_path
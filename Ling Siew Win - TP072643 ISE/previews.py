@@ -0,0 +1,67 @@
+from PIL import Image
+import hashlib
+
+from disk_cache import cached, cache_folder, load_image, save_image
+
+# largest preview, about one cell of a 3 x 3 figure on screen
+PREVIEW_SIZE = (480, 480)
+
+# bump this to ignore previews cached by an older version
+PREVIEW_CACHE_VERSION = 1
+
+PREVIEW_CACHE_DIR = cache_folder('.preview_cache')
+
+def preview_size(size, max_size=PREVIEW_SIZE):
+    # largest size with the same aspect ratio that fits in max_size, never enlarged
+    scale = min(max_size[0] / size[0], max_size[1] / size[1], 1)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+def make_preview(image, max_size=PREVIEW_SIZE):
+    """
+    Screen sized copy of an image for display.
+
+    Shrinks by a whole factor with a box filter first and resamples only
+    the small result, which is much faster than resampling the full image.
+
+    :param image: PIL image.
+    :param max_size: (width, height) the preview has to fit in.
+    :return: PIL image no larger than max_size.
+    """
+    size = preview_size(image.size, max_size)
+    if size == image.size:
+        return image
+    return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+def preview_key(file_bytes, max_size=PREVIEW_SIZE):
+    """
+    Cache key of a preview: the file content, the preview size and the
+    cache version.
+    """
+    digest = hashlib.sha256(('v%d|%r|' % (PREVIEW_CACHE_VERSION, tuple(max_size))).encode())
+    digest.update(file_bytes)
+    return digest.hexdigest()
+
+def load_preview(image_path, max_size=PREVIEW_SIZE, mode='RGB', cache_dir=PREVIEW_CACHE_DIR):
+    """
+    Preview of an image file, made once and reused from the cache while
+    the file stays the same.
+
+    JPEGs are decoded at a reduced scale when the preview is made, so the
+    full image is never decoded for it.
+
+    :param image_path: Path of the image.
+    :param max_size: (width, height) the preview has to fit in.
+    :param mode: PIL mode of the preview.
+    :param cache_dir: Folder for the cached previews, None disables the cache.
+    :return: PIL image no larger than max_size.
+    """
+    def compute():
+        with Image.open(image_path) as image:
+            image.draft(mode, preview_size(image.size, max_size))
+            return make_preview(image.convert(mode), max_size)
+
+    if cache_dir is None:
+        return compute()
+    with open(image_path, 'rb') as file:
+        key = preview_key(file.read(), max_size)
+    return cached('%s_%s' % (key, mode), cache_dir, load_image, save_image, compute, '.png')
@@ -0,0 +1,411 @@
+import numpy as np
+import os
+
+from parallel import imap_frames
+
+# tile states stored in a tile index
+TRANSPARENT, OPAQUE, MIXED = 0, 1, 2
+
+def build_tile_index(image, tile_size=64):
+    """
+    Classify the tiles of an RGBA layer by their alpha.
+
+    Every tile is marked TRANSPARENT, OPAQUE or MIXED. Neighbouring tiles
+    with the same state are merged into rectangular spans, and transparent
+    spans are dropped since blending them is a no-op.
+
+    :param image: RGBA layer (straight or premultiplied alpha).
+    :param tile_size: Tile edge length in pixels.
+    :return: Dictionary with the tile size, the state grid and the spans
+             as (state, y0, y1, x0, x1) tuples in layer coordinates.
+    """
+    alpha = image[..., 3]
+    image_height, image_width = alpha.shape
+    rows = np.arange(0, image_height, tile_size)
+    cols = np.arange(0, image_width, tile_size)
+    tile_min = np.minimum.reduceat(np.minimum.reduceat(alpha, rows, axis=0), cols, axis=1)
+    tile_max = np.maximum.reduceat(np.maximum.reduceat(alpha, rows, axis=0), cols, axis=1)
+
+    states = np.full(tile_min.shape, MIXED, dtype=np.uint8)
+    states[tile_max <= 0] = TRANSPARENT
+    states[tile_min >= 1] = OPAQUE
+
+    spans = []
+    previous_row = {}
+    for row, y0 in enumerate(rows):
+        y0 = int(y0)
+        y1 = min(y0 + tile_size, image_height)
+        current_row = {}
+        start = 0
+        for col in range(1, len(cols) + 1):
+            if col < len(cols) and states[row, col] == states[row, start]:
+                continue
+            state = int(states[row, start])
+            if state != TRANSPARENT:
+                x0, x1 = int(cols[start]), min(int(cols[col - 1]) + tile_size, image_width)
+                # grow the span from the row above when it lines up exactly
+                if (state, x0, x1) in previous_row:
+                    span = previous_row[(state, x0, x1)]
+                    spans[span] = (state, spans[span][1], y1, x0, x1)
+                else:
+                    span = len(spans)
+                    spans.append((state, y0, y1, x0, x1))
+                current_row[(state, x0, x1)] = span
+            start = col
+        previous_row = current_row
+
+    return {'tile_size': tile_size, 'states': states, 'spans': spans}
+
+def _overlap(base, overlay, x, y):
+    # clip the overlay rectangle placed at (x, y) to the base canvas
+    base_height, base_width = base.shape[-3:-1]
+    overlay_height, overlay_width = overlay.shape[-3:-1]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + overlay_width, base_width), min(y + overlay_height, base_height)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    base_region = (Ellipsis, slice(y0, y1), slice(x0, x1), slice(None))
+    overlay_region = (Ellipsis, slice(y0 - y, y1 - y), slice(x0 - x, x1 - x), slice(None))
+    return base_region, overlay_region
+
+def _copy_opaque(base, overlay, x, y):
+    # opaque pixels replace the canvas outright
+    region = _overlap(base, overlay, x, y)
+    if region is None:
+        return
+    target = base[region[0]]
+    target[..., :3] = overlay[region[1]][..., :3]
+    target[..., 3] = 1.
+
+# function to overlay transparent png images
+def overlayImage(base, overlay, x=0, y=0, tiles=None):
+    """
+    Blend a straight alpha RGBA overlay into base in place.
+
+    Only the overlay's rectangle at (x, y), clipped to the canvas, is read
+    or written, and the only temporaries are the size of that rectangle.
+    Alpha is combined with the usual "over" rule, which matches the old
+    full-canvas version whenever the canvas is already opaque.
+
+    :param base: RGBA canvas, modified in place.
+    :param overlay: RGBA image to blend on top.
+    :param x: Column of the overlay's top left corner, may be negative.
+    :param y: Row of the overlay's top left corner, may be negative.
+    :param tiles: Tile index of the overlay from build_tile_index
+                  (optional). Transparent tiles are skipped, opaque tiles
+                  are copied and only mixed tiles are blended.
+    :return: The base canvas.
+    """
+    if tiles is not None:
+        for state, y0, y1, x0, x1 in tiles['spans']:
+            patch = overlay[..., y0:y1, x0:x1, :]
+            if state == OPAQUE:
+                _copy_opaque(base, patch, x + x0, y + y0)
+            else:
+                overlayImage(base, patch, x + x0, y + y0)
+        return base
+
+    region = _overlap(base, overlay, x, y)
+    if region is None:
+        return base
+    target = base[region[0]]
+    source = overlay[region[1]]
+    alpha = source[..., 3:4]
+
+    # rgb = rgb + (overlay - rgb) * alpha
+    blend = source[..., :3] - target[..., :3]
+    blend *= alpha
+    target[..., :3] += blend
+
+    # alpha = alpha + base_alpha * (1 - alpha)
+    coverage = 1. - target[..., 3:4]
+    coverage *= alpha
+    target[..., 3:4] += coverage
+    return base
+
+def premultiply(image):
+    # copy of the layer with rgb scaled by alpha
+    premultiplied = image.astype(np.float32)
+    premultiplied[..., :3] *= premultiplied[..., 3:4]
+    return premultiplied
+
+def flatten_layers(layers, names, tile_indexes=None):
+    """
+    Flatten a run of layers into a single premultiplied RGBA layer.
+
+    Blending the result with overlayFlattened gives the same image as
+    blending every layer in the run one after the other.
+
+    :param layers: Dictionary of straight alpha RGBA layers.
+    :param names: Layer names in bottom to top order.
+    :param tile_indexes: Dictionary of tile indexes per layer (optional).
+    """
+    tile_indexes = tile_indexes or {}
+    flattened = None
+    for name in names:
+        layer = premultiply(layers[name])
+        if flattened is None:
+            flattened = layer
+            continue
+        # the new layer goes on top of everything flattened so far
+        overlayFlattened(flattened, layer, tiles=tile_indexes.get(name))
+    return flattened
+
+# overlay a premultiplied layer produced by flatten_layers, in place
+def overlayFlattened(base, flattened, x=0, y=0, tiles=None):
+    if tiles is not None:
+        for state, y0, y1, x0, x1 in tiles['spans']:
+            patch = flattened[..., y0:y1, x0:x1, :]
+            if state == OPAQUE:
+                _copy_opaque(base, patch, x + x0, y + y0)
+            else:
+                overlayFlattened(base, patch, x + x0, y + y0)
+        return base
+
+    region = _overlap(base, flattened, x, y)
+    if region is None:
+        return base
+    target = base[region[0]]
+    source = flattened[region[1]]
+    target *= 1. - source[..., 3:4]
+    target += source
+    return base
+
+def flatten_static_layers(layers, order, animated, tile_indexes=None):
+    """
+    Pre-flatten the layers that never change between frames.
+
+    The static layers below the first animated layer are combined into a
+    base canvas, and every run of static layers between or above animated
+    layers is flattened into one premultiplied layer. Each frame then only
+    needs a copy of the base plus one blend per animated layer and per run.
+
+    :param layers: Dictionary of RGBA layers.
+    :param order: Layer names in bottom to top order.
+    :param animated: Names of the layers that change between frames.
+    :param tile_indexes: Dictionary of tile indexes per layer (optional).
+    :return: Render plan for render_stack.
+    """
+    tile_indexes = tile_indexes or {}
+    image_height, image_width, _ = layers[order[0]].shape
+    base = np.zeros((image_height, image_width, 4), dtype=np.float32)
+
+    # combine everything below the first animated layer into the base
+    position = 0
+    while position < len(order) and order[position] not in animated:
+        overlayImage(base, layers[order[position]], tiles=tile_indexes.get(order[position]))
+        position += 1
+
+    def flatten_run(run):
+        flattened = flatten_layers(layers, run, tile_indexes)
+        return ('flattened', flattened, build_tile_index(flattened))
+
+    steps = []
+    run = []
+    for name in order[position:]:
+        if name in animated:
+            if run:
+                steps.append(flatten_run(run))
+                run = []
+            steps.append(('animated', name, None))
+        else:
+            run.append(name)
+    if run:
+        steps.append(flatten_run(run))
+
+    return {'base': base, 'steps': steps}
+
+def make_sprite(image, tile_size=64):
+    """
+    Crop a layer to the bounding box of its visible pixels.
+
+    A one pixel transparent margin is kept around the box so that subpixel
+    moves interpolate against the layer's own neighbouring pixels.
+
+    :param image: Canvas-sized RGBA layer.
+    :param tile_size: Tile edge length for the sprite's tile index.
+    :return: Sprite dictionary with the cropped image, its position in the
+             layer and its tile index.
+    """
+    image_height, image_width, _ = image.shape
+    visible = image[..., 3] > 0
+    rows = np.flatnonzero(visible.any(axis=1))
+    cols = np.flatnonzero(visible.any(axis=0))
+    if len(rows) == 0:
+        rows, cols = np.array([0]), np.array([0])
+    y0, y1 = max(rows[0] - 1, 0), min(rows[-1] + 2, image_height)
+    x0, x1 = max(cols[0] - 1, 0), min(cols[-1] + 2, image_width)
+
+    cropped = image[y0:y1, x0:x1].astype(np.float32)
+    return {'image': cropped, 'x': int(x0), 'y': int(y0), 'tiles': build_tile_index(cropped, tile_size)}
+
+def _lerp_shift(image, fraction, axis):
+    # move an image by a fraction of a pixel along an axis, the result is one pixel larger
+    pad = [(0, 0)] * image.ndim
+    pad[axis] = (1, 1)
+    padded = np.pad(image, pad)
+    length = padded.shape[axis]
+    ahead = padded.take(np.arange(1, length), axis=axis)
+    behind = padded.take(np.arange(0, length - 1), axis=axis)
+    ahead *= 1. - fraction
+    ahead += fraction * behind
+    return ahead
+
+def place_sprite(base, sprite, dx=0., dy=0.):
+    """
+    Blend a sprite into base, moved by a float offset from its own position.
+
+    Whole pixel moves are only slice offsets. A fractional move is a linear
+    interpolation between neighbouring pixels over the sprite's bounding
+    box, the same result as an order 1 warp of the full layer. Offsets are
+    always applied to the original sprite, so moves never compound.
+
+    :param base: RGBA canvas, modified in place.
+    :param sprite: Sprite from make_sprite.
+    :param dx: Horizontal offset in pixels, positive moves right.
+    :param dy: Vertical offset in pixels, positive moves down.
+    :return: The base canvas.
+    """
+    x = sprite['x'] + dx
+    y = sprite['y'] + dy
+    x_pixel, y_pixel = int(np.floor(x)), int(np.floor(y))
+    x_fraction, y_fraction = x - x_pixel, y - y_pixel
+
+    if x_fraction == 0 and y_fraction == 0:
+        return overlayImage(base, sprite['image'], x_pixel, y_pixel, tiles=sprite['tiles'])
+
+    image = sprite['image']
+    if x_fraction:
+        image = _lerp_shift(image, x_fraction, axis=1)
+    if y_fraction:
+        image = _lerp_shift(image, y_fraction, axis=0)
+    return overlayImage(base, image, x_pixel, y_pixel)
+
+def render_stack(plan, animated_layers, out=None):
+    """
+    Render one frame from a plan made by flatten_static_layers.
+
+    :param plan: Render plan.
+    :param animated_layers: Dictionary with this frame's animated layers.
+                            A value is either an RGBA layer or a
+                            (sprite, dx, dy) placement for place_sprite.
+    :param out: Preallocated canvas to render into (optional). A canvas
+                with a leading batch axis renders several frames at once
+                when the animated layers have the same batch axis, or are
+                lists with one placement per frame.
+    :return: Combined RGBA image.
+    """
+    if out is None:
+        out = np.empty_like(plan['base'])
+    np.copyto(out, plan['base'])
+    for kind, value, tiles in plan['steps']:
+        if kind == 'animated':
+            animated = animated_layers[value]
+            if isinstance(animated, np.ndarray):
+                overlayImage(out, animated)
+            elif isinstance(animated, list):
+                for canvas, placement in zip(out, animated):
+                    place_sprite(canvas, *placement)
+            else:
+                place_sprite(out, *animated)
+        else:
+            overlayFlattened(out, value, tiles=tiles)
+    return out
+
+def frames_per_batch(frame_shape, memory_budget, buffers=4):
+    """
+    Number of frames that can be rendered together within a memory budget.
+
+    :param frame_shape: Shape of one RGBA frame.
+    :param memory_budget: Budget in bytes for one batch.
+    :param buffers: Float32 frame-sized buffers needed per frame, covering
+                    the canvas, the animated layers and blend temporaries.
+    :return: Batch size, at least 1.
+    """
+    frame_bytes = int(np.prod(frame_shape)) * np.dtype(np.float32).itemsize * buffers
+    return max(1, int(memory_budget // frame_bytes))
+
+def to_uint8(images, out=None):
+    # clip, scale and truncate float images to 8 bit, modifies images in place
+    np.clip(images, 0, 1, out=images)
+    images *= 255
+    if out is None:
+        out = np.empty(images.shape, dtype=np.uint8)
+    np.copyto(out, images, casting='unsafe')
+    return out
+
+def render_batches(plan, frames, animate, finish=None, memory_budget=512 * 1024 ** 2):
+    """
+    Render frames in batches, each batch as one (batch, H, W, 4) broadcast.
+
+    :param plan: Render plan from flatten_static_layers.
+    :param frames: Frame indices to render.
+    :param animate: Function taking an array of frame indices and returning
+                    a dictionary of animated layers with a leading batch axis.
+    :param finish: Function taking the float batch and its frame indices,
+                   applied in place before conversion to 8 bit (optional).
+    :param memory_budget: Bytes to spend per batch, sets the batch size.
+    :return: Generator of 8 bit RGBA frames. The frames are views into a
+             reused buffer, so use or copy each one before the next.
+    """
+    frames = np.asarray(frames)
+    if len(frames) == 0:
+        return
+    frame_shape = plan['base'].shape
+    batch_size = min(len(frames), frames_per_batch(frame_shape, memory_budget))
+    images = np.empty((batch_size,) + frame_shape, dtype=np.float32)
+    images_uint8 = np.empty((batch_size,) + frame_shape, dtype=np.uint8)
+
+    for start in range(0, len(frames), batch_size):
+        batch_frames = frames[start:start + batch_size]
+        batch = images[:len(batch_frames)]
+        render_stack(plan, animate(batch_frames), out=batch)
+        if finish is not None:
+            finish(batch, batch_frames)
+        batch_uint8 = to_uint8(batch, out=images_uint8[:len(batch_frames)])
+        for image in batch_uint8:
+            yield image
+
+def _render_batch(frames, state):
+    # render one batch of frames in a worker process
+    plan = state['plan']
+    images = np.empty((len(frames),) + plan['base'].shape, dtype=np.float32)
+    render_stack(plan, state['animate'](frames), out=images)
+    if state['finish'] is not None:
+        state['finish'](images, frames)
+    return to_uint8(images)
+
+def render_parallel(plan, frames, animate, finish=None, workers=None, memory_budget=512 * 1024 ** 2):
+    """
+    Render frames on a process pool, like render_batches.
+
+    The plan and any arrays passed to animate or finish through
+    functools.partial are put in shared memory once and read by every
+    worker. animate and finish have to be module level functions (or
+    partials of them) and must only depend on the frame indices.
+
+    :param plan: Render plan from flatten_static_layers.
+    :param frames: Frame indices to render.
+    :param animate: Same as for render_batches.
+    :param finish: Same as for render_batches (optional).
+    :param workers: Number of worker processes, None uses every core and 1
+                    falls back to render_batches.
+    :param memory_budget: Bytes to spend on batches across all workers.
+    :return: Generator of 8 bit RGBA frames in frame order.
+    """
+    frames = np.asarray(frames)
+    if workers is None:
+        workers = os.cpu_count()
+    if workers == 1:
+        yield from render_batches(plan, frames, animate, finish, memory_budget)
+        return
+
+    # small enough batches that every worker gets some
+    batch_size = frames_per_batch(plan['base'].shape, memory_budget // workers)
+    batch_size = max(1, min(batch_size, -(-len(frames) // workers)))
+    batches = [frames[start:start + batch_size] for start in range(0, len(frames), batch_size)]
+
+    state = {'plan': plan, 'animate': animate, 'finish': finish}
+    for images in imap_frames(_render_batch, batches, state, workers):
+        for image in images:
+            yield image
@@ -0,0 +1,319 @@
+from concurrent.futures import ProcessPoolExecutor
+from skimage import exposure, restoration, img_as_float
+import numpy as np
+
+# image modifications shared by img1main.py and img2main.py
+
+def _denoise_tile(rgb_tile, intensity):
+    # runs in a worker process, so it has to be a module level function
+    return restoration.denoise_tv_chambolle(rgb_tile, weight=intensity)
+
+def _denoise_tiled(rgb_image, alpha_channel, intensity, tile_size, halo, workers):
+    image_height, image_width, _ = rgb_image.shape
+    denoised = rgb_image.copy()
+
+    # every tile is denoised with a halo of neighbouring pixels around it,
+    # then only its own pixels are kept so the seams match up
+    jobs = []
+    for top in range(0, image_height, tile_size):
+        for left in range(0, image_width, tile_size):
+            bottom, right = min(top + tile_size, image_height), min(left + tile_size, image_width)
+            if not alpha_channel[top:bottom, left:right].any():
+                continue  # fully transparent, nothing visible to denoise
+            outer_top, outer_left = max(top - halo, 0), max(left - halo, 0)
+            outer_bottom, outer_right = min(bottom + halo, image_height), min(right + halo, image_width)
+            core = (slice(top - outer_top, bottom - outer_top), slice(left - outer_left, right - outer_left))
+            jobs.append(((slice(top, bottom), slice(left, right)), core, rgb_image[outer_top:outer_bottom, outer_left:outer_right]))
+
+    if workers == 1:
+        results = (_denoise_tile(tile, intensity) for _, _, tile in jobs)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(_denoise_tile, [tile for _, _, tile in jobs], [intensity] * len(jobs))
+
+    try:
+        for (target, core, _), result in zip(jobs, results):
+            denoised[target] = result[core]
+    finally:
+        if workers != 1:
+            pool.shutdown()
+
+    return denoised
+
+def denoise(image, intensity=1, tile_size=None, halo=16, workers=None):
+    """
+    Total variation denoising of the RGB channels of an RGBA image.
+
+    With tile_size set, the image is split into tiles that are denoised on
+    a process pool, each with a halo of extra pixels around it. Tiles with
+    no visible pixels are skipped and keep their original values. Chambolle
+    is a global method, so tiled results differ slightly from a single pass
+    near tile edges; a larger halo brings them closer. Scripts using the
+    pool need an if __name__ == '__main__' guard on platforms that spawn
+    worker processes.
+
+    :param image: RGBA image.
+    :param intensity: Denoising weight.
+    :param tile_size: Tile edge length in pixels, None denoises in one pass.
+    :param halo: Extra pixels around each tile.
+    :param workers: Number of worker processes, None uses every core and 1
+                    runs the tiles in this process.
+    """
+    if intensity < 0:
+        raise ValueError("intensity must be a non-negative number")
+    if image.shape[2] != 4:
+        raise ValueError("input image must be an RGBA image")
+
+    rgb_image = image[:, :, :3]
+    alpha_channel = image[:, :, 3]
+
+    # apply denoising to rgb channels
+    if tile_size is None:
+        rgb_image = restoration.denoise_tv_chambolle(rgb_image, weight=intensity)
+    else:
+        rgb_image = _denoise_tiled(img_as_float(rgb_image), alpha_channel, intensity, tile_size, halo, workers)
+
+    # recombine with alpha
+    modified_image = np.dstack((rgb_image, alpha_channel))
+
+    return modified_image
+
+def _saturate_visible(image, factor):
+    # scale hsv saturation in place, only where alpha > 0
+    visible = image[..., 3] > 0
+    rgb = image[..., :3][visible]
+
+    # hue and value stay the same, so every channel moves along the line
+    # towards the value (the largest channel): c' = v + ratio * (c - v)
+    value = rgb.max(axis=-1, keepdims=True)
+    delta = value - rgb.min(axis=-1, keepdims=True)
+
+    # saturation is delta / value and gets clipped to 1, which caps the ratio at value / delta
+    ratio = np.full_like(value, factor)
+    limit = np.divide(value, delta, out=np.full_like(value, np.inf), where=delta > 0)
+    np.minimum(ratio, limit, out=ratio)
+
+    rgb -= value
+    rgb *= ratio
+    rgb += value
+    image[..., :3][visible] = rgb
+
+def saturate(image, factor=1):
+    """
+    Scale the HSV saturation of an RGBA image without converting to HSV.
+
+    Matches rgb2hsv -> scale and clip S -> hsv2rgb to within 1e-12 on
+    every pixel with alpha > 0. Fully transparent pixels are left as they
+    are, since they never show up in the composite.
+    """
+    if factor < 0:
+        raise ValueError("intensity must be a non-negative number")
+    if image.shape[2] != 4:
+        raise ValueError("input image must be an RGBA image")
+
+    modified_image = img_as_float(image).astype(np.float64)
+    _saturate_visible(modified_image, factor)
+
+    return modified_image
+
+def redden(image, intensity=1):
+    if intensity < 0:
+        raise ValueError("intensity must be a non-negative number")
+    if image.shape[2] != 4:
+        raise ValueError("input image must be an RGBA image")
+
+    # copy image to modify
+    modified_image = image.copy()
+
+    # separate channels
+    red_channel = modified_image[:, :, 0]
+    green_channel = modified_image[:, :, 1]
+    blue_channel = modified_image[:, :, 2]
+
+    # apply red filter
+    modified_image[:, :, 0] = np.clip(red_channel * intensity, 0, 1)
+
+    # reduce other channels
+    scale = max(0, 1 - 0.5 * (intensity - 1))   # this controls the amount of reduction
+    modified_image[:, :, 1] = np.clip(green_channel * scale, 0, 1)
+    modified_image[:, :, 2] = np.clip(blue_channel * scale, 0, 1)
+
+    return modified_image
+
+def contrast(image, in_range, out_range):
+    # Separate channels
+    r, g, b, a = image[:, :, 0], image[:, :, 1], image[:, :, 2], image[:, :, 3]
+
+    # Apply contrast stretching to RGB channels
+    r = exposure.rescale_intensity(r, in_range=in_range, out_range=out_range)
+    g = exposure.rescale_intensity(g, in_range=in_range, out_range=out_range)
+    b = exposure.rescale_intensity(b, in_range=in_range, out_range=out_range)
+
+    # Combine channels back
+    adjusted_image = np.stack([r, g, b, a], axis=-1)
+
+    return adjusted_image
+
+def gamma(image, gamma=1):
+    modified_image = exposure.adjust_gamma(image, gamma=gamma)
+    return modified_image
+
+# used for clouds, preserves alpha
+def darken(image, gamma=1):
+    # adjust the gamma value for darkening
+    modified_image = exposure.adjust_gamma(image[:, :, :3], gamma)  # apply gamma correction to RGB channels
+
+    # preserve alpha channel
+    alpha_channel = image[:, :, 3]
+    modified_image = np.dstack((modified_image, alpha_channel))  # reattach alpha channel
+
+    return modified_image
+
+# per channel versions of the pointwise modifications above, used by compile_chain
+# each returns one function per rgba channel, None leaves that channel alone
+
+def _power_channel(exponent):
+    def channel(values):
+        if values.min() < 0:
+            raise ValueError("Image Correction methods work correctly only on images with non-negative values.")
+        return values ** exponent
+    return channel
+
+def _gamma_channels(gamma=1):
+    if gamma < 0:
+        raise ValueError("Gamma should be a non-negative real number.")
+    return [_power_channel(gamma)] * 4
+
+def _darken_channels(gamma=1):
+    return _gamma_channels(gamma)[:3] + [None]
+
+def _redden_channels(intensity=1):
+    if intensity < 0:
+        raise ValueError("intensity must be a non-negative number")
+    scale = max(0, 1 - 0.5 * (intensity - 1))
+    return [
+        lambda values: np.clip(values * intensity, 0, 1),
+        lambda values: np.clip(values * scale, 0, 1),
+        lambda values: np.clip(values * scale, 0, 1),
+        None
+    ]
+
+def _contrast_channels(in_range, out_range):
+    in_min, in_max = map(float, in_range)
+    out_min, out_max = map(float, out_range)
+
+    # same arithmetic as exposure.rescale_intensity
+    def channel(values):
+        values = np.clip(values, in_min, in_max)
+        if in_min == in_max:
+            return np.clip(values, out_min, out_max)
+        values = (values - in_min) / (in_max - in_min)
+        return values * (out_max - out_min) + out_min
+
+    return [channel] * 3 + [None]
+
+def _saturate_pixels(factor=1):
+    if factor < 0:
+        raise ValueError("intensity must be a non-negative number")
+
+    def pixels(strip):
+        _saturate_visible(strip, factor)
+
+    return pixels
+
+_CHANNEL_OPS = {gamma: _gamma_channels, darken: _darken_channels, redden: _redden_channels, contrast: _contrast_channels}
+_PIXEL_OPS = {saturate: _saturate_pixels}
+
+# rough size of the rows processed together by a fused stage
+STRIP_BYTES = 1 << 20
+
+def compile_chain(funcs):
+    """
+    Compile a modification chain into fused stages.
+
+    Consecutive pointwise modifications are merged into one 'fused' stage
+    that is applied strip by strip into a single output buffer. Anything
+    that is not pointwise, like denoise, stays a 'barrier' stage and runs
+    on the whole image as before.
+
+    :param funcs: List of (function, arguments...) tuples.
+    :return: List of stages for apply_chain.
+    """
+    stages = []
+    for func, *args in funcs:
+        if func in _CHANNEL_OPS:
+            kernel = ('channels', _CHANNEL_OPS[func](*args))
+        elif func in _PIXEL_OPS:
+            kernel = ('pixels', _PIXEL_OPS[func](*args))
+        else:
+            stages.append(('barrier', func, args))
+            continue
+        if stages and stages[-1][0] == 'fused':
+            stages[-1][1].append(kernel)
+        else:
+            stages.append(('fused', [kernel]))
+    return stages
+
+def _run_fused(image, kernels):
+    if image.ndim != 3 or image.shape[2] != 4:
+        raise ValueError("input image must be an RGBA image")
+    out = image.astype(np.float64)
+    rows = max(1, STRIP_BYTES // (out.shape[1] * 4 * out.itemsize))
+
+    # run every kernel on a few rows at a time so they stay in cache
+    for top in range(0, out.shape[0], rows):
+        strip = out[top:top + rows]
+        for kind, kernel in kernels:
+            if kind == 'pixels':
+                kernel(strip)
+                continue
+            for channel, function in enumerate(kernel):
+                if function is not None:
+                    strip[..., channel] = function(strip[..., channel])
+    return out
+
+def _run_lut(image, kernels):
+    if image.ndim != 3 or image.shape[2] != 4:
+        raise ValueError("input image must be an RGBA image")
+
+    # evaluate the per channel functions once for every 8 bit level
+    levels = img_as_float(np.arange(256, dtype=np.uint8))
+    tables = np.empty((4, 256))
+    for channel in range(4):
+        values = levels
+        for _, functions in kernels:
+            if functions[channel] is not None:
+                values = functions[channel](values)
+        tables[channel] = values
+
+    # offset each channel into its own table so one gather covers all four
+    indices = image.astype(np.uint16)
+    indices += np.arange(4, dtype=np.uint16) * 256
+    return tables.ravel().take(indices)
+
+def apply_chain(image, stages):
+    """
+    Apply a chain compiled by compile_chain to an RGBA image.
+
+    8 bit images run the leading per channel modifications as 256 entry
+    lookup tables, one gather for the whole layer, giving exactly what the
+    float path gives. The result is always a float image.
+    """
+    if image.dtype == np.uint8:
+        if stages and stages[0][0] == 'fused':
+            kernels = stages[0][1]
+            count = 0
+            while count < len(kernels) and kernels[count][0] == 'channels':
+                count += 1
+            if count:
+                image = _run_lut(image, kernels[:count])
+                stages = ([('fused', kernels[count:])] if count < len(kernels) else []) + stages[1:]
+        image = img_as_float(image)
+
+    for stage in stages:
+        if stage[0] == 'fused':
+            image = _run_fused(image, stage[1])
+        else:
+            _, func, args = stage
+            image = func(image, *args)
+    return image
@@ -0,0 +1,142 @@
+from PIL import Image, GifImagePlugin
+import numpy as np
+
+def build_palette(images, colors=255):
+    """
+    Build one palette that covers the colours of several frames.
+
+    :param images: PIL images or numpy arrays to sample colours from.
+    :param colors: Number of palette entries. The default leaves one of
+                   the 256 GIF entries free to mark unchanged pixels.
+    :return: Palette image for GifWriter.
+    """
+    images = [image if isinstance(image, Image.Image) else Image.fromarray(image) for image in images]
+    images = [image.convert('RGB') for image in images]
+
+    # stack the samples vertically and quantize them together
+    width = max(image.width for image in images)
+    sheet = Image.new('RGB', (width, sum(image.height for image in images)))
+    top = 0
+    for image in images:
+        sheet.paste(image, (0, top))
+        top += image.height
+    return sheet.quantize(colors, method=Image.Quantize.FASTOCTREE)
+
+class GifWriter:
+    """
+    Write an animated GIF one frame at a time.
+
+    Only the rectangle that changed since the previous frame is encoded, so
+    memory use does not grow with the number of frames. Sparse changes are
+    mapped onto a single global palette, and when the palette has a free
+    entry, pixels inside the rectangle that did not change are written as
+    transparent when that makes the frame smaller. When a large part of
+    the picture changes, the rectangle is quantized on its own into a local
+    colour table instead, like PIL does for every frame, which is much
+    smaller than the shared palette for such frames.
+
+    :param path: Path where the GIF will be saved.
+    :param duration: Duration of each frame in milliseconds.
+    :param loop: Number of loops, 0 loops forever.
+    :param palette: Palette image from build_palette (optional). When it is
+                    not given the palette is built from the first frame.
+    :param dither: Dither frames when mapping them to the palette.
+    :param local_changes: Fraction of the pixels that have to change from
+                          the previous frame to use a local colour table,
+                          None always uses the global palette.
+    """
+
+    def __init__(self, path, duration=100, loop=0, palette=None, dither=False, local_changes=0.25):
+        self.path = path
+        self.duration = duration
+        self.loop = loop
+        self.palette = palette
+        self.dither = Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE
+        self.local_changes = local_changes
+        self.transparency = None
+        self.colors = None
+        self.shown = None
+        self.previous = None
+        self.file = open(path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, frame):
+        """
+        Encode a frame, given as a PIL image or a numpy array.
+        """
+        image = frame if isinstance(frame, Image.Image) else Image.fromarray(frame)
+        image = image.convert('RGB')
+        if self.palette is None:
+            self.palette = build_palette([image])
+        if self.colors is None:
+            colors = len(self.palette.getpalette()) // 3
+            self.transparency = colors if colors < 256 else None
+            self.colors = np.array(self.palette.getpalette()[:colors * 3], dtype=np.uint8).reshape(-1, 3)
+        indexed = image.quantize(palette=self.palette, dither=self.dither)
+        indices = np.asarray(indexed)
+        # colours of the frame on the global palette
+        mapped = self.colors[indices]
+
+        if self.shown is None:
+            header, _ = GifImagePlugin.getheader(indexed, info={'loop': self.loop, 'duration': self.duration})
+            for block in header:
+                self.file.write(block)
+            self.shown = np.empty_like(mapped)
+            box = (0, 0, image.width, image.height)
+        elif mapped.shape != self.shown.shape:
+            raise ValueError("all frames must have the same size")
+        else:
+            box = self._changed_box(mapped)
+
+        # disposal 1 keeps the previous frame under the changed rectangle
+        left, top, right, bottom = box
+        params = {'duration': self.duration, 'disposal': 1}
+        # changes are counted on the global palette, the local colours of earlier frames would count every pixel.
+        # the first frame stays on the global palette so a still background can be kept transparent after it
+        changes = 0 if self.previous is None else (mapped != self.previous).any(axis=2).mean()
+        self.previous = mapped
+        if self.local_changes is not None and changes >= self.local_changes:
+            # quantized on its own the way PIL's GIF save does for RGBA frames
+            patch = image.crop(box).convert('RGBA').convert('P', palette=Image.Palette.ADAPTIVE)
+            blocks = GifImagePlugin.getdata(patch, offset=box[:2], include_color_table=True, **params)
+            shown = np.asarray(patch.convert('RGB'))
+        else:
+            patch = indexed.crop(box)
+            blocks = GifImagePlugin.getdata(patch, offset=box[:2], **params)
+            shown = mapped[top:bottom, left:right]
+            if self.transparency is not None:
+                patch_indices = indices[top:bottom, left:right].copy()
+                unchanged = (shown == self.shown[top:bottom, left:right]).all(axis=2)
+                if unchanged.any():
+                    # when most of the rectangle changes the transparent pixels are scattered
+                    # and compress worse than the plain pixels, so keep whichever is smaller
+                    patch_indices[unchanged] = self.transparency
+                    patch.frombytes(patch_indices.tobytes())
+                    transparent_blocks = GifImagePlugin.getdata(patch, offset=box[:2], transparency=self.transparency, **params)
+                    if sum(map(len, transparent_blocks)) < sum(map(len, blocks)):
+                        blocks = transparent_blocks
+        self.shown[top:bottom, left:right] = shown
+        for block in blocks:
+            self.file.write(block)
+
+    def _changed_box(self, mapped):
+        # rectangle around the pixels whose colour differs from what is shown
+        changed = (mapped != self.shown).any(axis=2)
+        rows = np.flatnonzero(changed.any(axis=1))
+        if len(rows) == 0:
+            # identical frame, still needs an entry to keep the timing
+            return (0, 0, 1, 1)
+        cols = np.flatnonzero(changed[rows[0]:rows[-1] + 1].any(axis=0))
+        return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.shown is not None:
+            self.file.write(b';')  # gif trailer
+        self.file.close()
@@ -1,9 +1,14 @@
 import matplotlib.pyplot as plt
-from skimage import io, img_as_float, exposure, restoration, transform
-from skimage.color import rgb2hsv, hsv2rgb
+from skimage import io, img_as_float
 from PIL import Image
 import numpy as np
 import os
+from functools import partial
+
+from compositing import overlayImage, build_tile_index, flatten_static_layers, make_sprite, render_parallel
+from filters import gamma, redden, contrast, saturate, denoise
+from layer_cache import load_layer
+from gif_writer import GifWriter
 
 # get image folder
 components_dir = 'Marcelino Ares Pratama Putra - TP066419 ISE/components2'
@@ -20,100 +25,8 @@ manual_order = [
     'flag.png'
 ]
 
-# load images into a dictionary
-layers = {}
-for filename in manual_order:
-    filepath = os.path.join(components_dir, filename)
-    image = img_as_float(io.imread(filepath))
-    layers[filename] = image
-
 # do image modifications here
 
-# utility
-def denoise(image, intensity=1):
-    if intensity < 0:
-        raise ValueError("intensity must be a non-negative number")
-    if image.shape[2] != 4:
-        raise ValueError("input image must be an RGBA image")
-    
-    rgb_image = image[:, :, :3]
-    alpha_channel = image[:, :, 3]
-
-    # apply denoising to rgb channels
-    rgb_image = restoration.denoise_tv_chambolle(rgb_image, weight=intensity)
-
-    # recombine with alpha
-    modified_image = np.dstack((rgb_image, alpha_channel))
-
-    return modified_image
-
-def saturate(image, factor=1):
-    if factor < 0:
-        raise ValueError("intensity must be a non-negative number")
-    if image.shape[2] != 4:
-        raise ValueError("input image must be an RGBA image")
-    
-    # separate channels
-    rgba = image[..., :3]
-    alpha = image[..., 3]
-
-    # convert rgb to hsv
-    hsv = rgb2hsv(rgba)
-    hsv[..., 1] *= factor
-
-    # clip to 0-1 range
-    hsv[..., 1] = np.clip(hsv[..., 1], 0, 1)
-
-    # convert back
-    rgb = hsv2rgb(hsv)
-
-    # recombine with alpha
-    modified_image = np.dstack((rgb, alpha))
-
-    return modified_image
-    
-def redden(image, intensity=1):
-    if intensity < 0:
-        raise ValueError("intensity must be a non-negative number")
-    if image.shape[2] != 4:
-        raise ValueError("input image must be an RGBA image")
-
-    # copy image to modify
-    modified_image = image.copy()
-
-    # separate channels
-    red_channel = modified_image[:, :, 0]
-    green_channel = modified_image[:, :, 1]
-    blue_channel = modified_image[:, :, 2]
-
-    # apply red filter
-    modified_image[:, :, 0] = np.clip(red_channel * intensity, 0, 1)
-
-    # reduce other channels
-    scale = max(0, 1 - 0.5 * (intensity - 1))   # this controls the amount of reduction
-    modified_image[:, :, 1] = np.clip(green_channel * scale, 0, 1)
-    modified_image[:, :, 2] = np.clip(blue_channel * scale, 0, 1)
-
-    return modified_image
-
-def contrast(image, in_range, out_range):
-    # Separate channels
-    r, g, b, a = image[:, :, 0], image[:, :, 1], image[:, :, 2], image[:, :, 3]
-
-    # Apply contrast stretching to RGB channels
-    r = exposure.rescale_intensity(r, in_range=in_range, out_range=out_range)
-    g = exposure.rescale_intensity(g, in_range=in_range, out_range=out_range)
-    b = exposure.rescale_intensity(b, in_range=in_range, out_range=out_range)
-
-    # Combine channels back
-    adjusted_image = np.stack([r, g, b, a], axis=-1)
-    
-    return adjusted_image
-
-def gamma(image, gamma=1):
-    modified_image = exposure.adjust_gamma(image, gamma=gamma)
-    return modified_image
-
 # handle function modifications
 modifications = {
     'earth.png': [(gamma, 2), (redden, 1.2)],
@@ -122,87 +35,74 @@ modifications = {
     'clouds.png': [(redden, 4)]
 }
 
-# apply modifications
-for layer, funcs in modifications.items():
-    if layer in layers:
-        # Ensure funcs is a list of (function, arguments) tuples
-        if not isinstance(funcs, list):
-            funcs = [funcs]
-        # Apply each function with its associated arguments
-        for func, *args in funcs:
-            layers[layer] = func(layers[layer], *args)
-
-# initialize final image dimensions
-image_height, image_width, image_depth = layers[manual_order[0]].shape
-# create transparent canvas
-combined_image = np.zeros((image_height, image_width, 4), dtype=np.float32)
-
-# function to overlay transparent png images
-def overlayImage(base, overlay):
-    x, y = 0, 0  # change coordinates if needed for positioning
-    overlay_height, overlay_width, _ = overlay.shape
-    template = np.zeros((base.shape[0], base.shape[1], 4), dtype=np.float32)
-    template[y:y+overlay_height, x:x+overlay_width, :] = overlay
-    
-    mask = template[:, :, 3]
-    inv_mask = 1. - mask
-    result = base[:, :, :3] * inv_mask[:, :, np.newaxis] + template[:, :, :3] * mask[:, :, np.newaxis]
-    base[:, :, :3] = result
-    base[:, :, 3] = inv_mask + mask
-    return base
-
 # gif frames
-frames = []
 num_frames = 60
 frequency = 0.05 # how fast the sun should flash
 earth_movement = 0.07
 
-# comment / uncomment snippet below to save static frame 1 as an image
-# combine images
-# for filename in manual_order:
-#         image = layers[filename]
-#         combined_image = overlayImage(combined_image, image)
+# calculate sun intensity with a sine wave, each frame brightens or dims the sun a little more
+intensities = 1 + 0.1 * np.sin(2 * np.pi * frequency * np.arange(num_frames))
+sun_offsets = np.cumsum(intensities - 1) * 0.12
 
-# plt.imshow(combined_image)
-# plt.axis('off')
-# plt.show()
+# earth starts 120 pixels to the left and moves right a little faster every frame
+earth_shifts = -120 + earth_movement * np.cumsum(np.arange(num_frames))
 
-# pil_test_image = Image.fromarray((combined_image * 255).astype(np.uint8))
-# pil_test_image.save('Marcelino Ares Pratama Putra - TP066419 ISE/frame1.png')
+def animate(frames, sun_image, earth_sprite):
+    # load and modify sun
+    sun_images = np.add(sun_image, sun_offsets[frames, np.newaxis, np.newaxis, np.newaxis], dtype=np.float32)
+    np.clip(sun_images, 0, 1, out=sun_images)
 
-# move earth left first
-layers['earth.png'] = transform.warp(layers['earth.png'], transform.AffineTransform(translation=(-120, 0)).inverse, mode='edge', preserve_range=True)
+    # move earth, always from the original sprite so the blur does not build up
+    earth_placements = [(earth_sprite, earth_shifts[i], 0) for i in frames]
 
-for i in range(num_frames):
-    # base image for each frame
-    combined_image = np.zeros_like(layers[manual_order[0]])
+    return {'sun.png': sun_images, 'earth.png': earth_placements}
 
-    # calculate sun intensity with a sine wave
-    intensity = 1 + 0.1 * np.sin(2 * np.pi * frequency * i)
+# number of processes rendering frames, 1 renders in this process
+render_workers = os.cpu_count()
 
-    # load and modify sun
-    sun_image = layers['sun.png']
-    sun_image = np.clip(sun_image + (intensity - 1) * 0.12, 0, 1)
-    layers['sun.png'] = sun_image
+# everything below only runs in the main process, render workers import
+# this file for animate
+if __name__ == '__main__':
+    # load images into a dictionary with their modifications applied,
+    # prepared layers are cached on disk so unchanged layers are only mapped in
+    layers = {}
+    for filename in manual_order:
+        filepath = os.path.join(components_dir, filename)
+        funcs = modifications.get(filename, [])
+        # Ensure funcs is a list of (function, arguments) tuples
+        if not isinstance(funcs, list):
+            funcs = [funcs]
+        layers[filename] = load_layer(filepath, funcs)
 
-    # move earth towards the right
-    earth_image = layers['earth.png']
-    image_height, image_width, _ = earth_image.shape
-    x_shift = i * earth_movement  # pixels to move the earth image
+    # initialize final image dimensions
+    image_height, image_width, image_depth = layers[manual_order[0]].shape
+    # create transparent canvas
+    combined_image = np.zeros((image_height, image_width, 4), dtype=np.float32)
 
-    # translation matrix
-    translation_matrix = transform.AffineTransform(translation=(x_shift, 0))
-    earth_transformed = transform.warp(earth_image, translation_matrix.inverse, mode='edge', preserve_range=True)
+    # comment / uncomment snippet below to save static frame 1 as an image
+    # combine images
+    # for filename in manual_order:
+    #         image = layers[filename]
+    #         combined_image = overlayImage(combined_image, image)
 
-    layers['earth.png'] = earth_transformed
+    # plt.imshow(combined_image)
+    # plt.axis('off')
+    # plt.show()
 
-    # combine images
-    for filename in manual_order:
-        image = layers[filename]
-        combined_image = overlayImage(combined_image, image)
+    # pil_test_image = Image.fromarray((combined_image * 255).astype(np.uint8))
+    # pil_test_image.save('Marcelino Ares Pratama Putra - TP066419 ISE/frame1.png')
+
+    # only the sun and earth change between frames, flatten everything else once
+    tile_indexes = {filename: build_tile_index(layers[filename]) for filename in manual_order}
+    plan = flatten_static_layers(layers, manual_order, animated=['sun.png', 'earth.png'], tile_indexes=tile_indexes)
+
+    # cut the earth out once, every frame moves it from this sprite
+    earth_sprite = make_sprite(layers['earth.png'])
 
-    # Convert to PIL image and add to frames
-    pil_image = Image.fromarray((combined_image * 255).astype(np.uint8))
-    frames.append(pil_image)
+    # the sun layer and earth sprite are shared with the render workers through the partial
+    animate_scene = partial(animate, sun_image=layers['sun.png'], earth_sprite=earth_sprite)
 
-frames[0].save('Marcelino Ares Pratama Putra - TP066419 ISE/img2_moonview.gif', save_all=True, append_images=frames[1:], duration=100, loop=0)
\ No newline at end of file
+    # render batches of frames and write the gif frame by frame
+    with GifWriter('Marcelino Ares Pratama Putra - TP066419 ISE/img2_moonview.gif', duration=100, loop=0) as gif:
+        for image in render_parallel(plan, np.arange(num_frames), animate_scene, workers=render_workers):
+            gif.append(image)
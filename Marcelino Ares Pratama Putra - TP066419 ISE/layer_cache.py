@@ -0,0 +1,104 @@
+from skimage import io, img_as_float32
+import numpy as np
+import hashlib
+import inspect
+import os
+
+from filters import compile_chain, apply_chain
+
+# bump this when the stored layout changes to ignore older cache files
+CACHE_VERSION = 2
+
+# cache folder next to this file, ignored by git
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.layer_cache')
+
+# the least recently used layers are removed once the cache grows past this
+CACHE_MAX_BYTES = 1 << 30
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _chain_description(funcs):
+    # name and arguments of every step, plus a hash of the module defining it
+    # so editing a modification function also invalidates its layers
+    steps = []
+    for func, *args in funcs:
+        source = inspect.getsourcefile(func)
+        steps.append('%s.%s%r@%s' % (func.__module__, func.__qualname__, tuple(args), _file_digest(source)[:16]))
+    return ';'.join(steps)
+
+def layer_key(path, funcs=()):
+    """
+    Cache key of a prepared layer: the content of the source image, the
+    modification chain with its arguments, and the cache version.
+
+    :param path: Path of the source image.
+    :param funcs: List of (function, arguments...) tuples.
+    """
+    description = 'v%d|%s|%s' % (CACHE_VERSION, _file_digest(path), _chain_description(funcs))
+    return hashlib.sha256(description.encode()).hexdigest()
+
+def _evict(cache_dir, max_bytes, keep):
+    # remove the least recently used layers until the cache fits in max_bytes, never the one at keep
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.npy') and entry.path != keep:
+            info = entry.stat()
+            entries.append((info.st_mtime, info.st_size, entry.path))
+    total = sum(size for _, size, _ in entries) + os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def load_layer(path, funcs=(), cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """
+    Load an image, apply its modification chain and convert it to float32,
+    reusing the result of an earlier run when nothing has changed.
+
+    Prepared layers are stored as .npy files named after layer_key and are
+    opened memory mapped, so a warm start only maps the files. The returned
+    array is read only; copy it before modifying it in place. Layers
+    without modifications are not cached, decoding them again is about as
+    fast as mapping a float copy four times the size of the image.
+
+    :param path: Path of the source image.
+    :param funcs: List of (function, arguments...) tuples, may be empty.
+    :param cache_dir: Folder for the cache files, None disables the cache.
+    :param max_bytes: Size the cache folder is trimmed to after a write,
+                      by removing the least recently used layers.
+    :return: Prepared float32 layer.
+    """
+    if not funcs:
+        cache_dir = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, layer_key(path, funcs) + '.npy')
+        if os.path.exists(cache_path):
+            # touch the file so eviction sees it as recently used
+            os.utime(cache_path)
+            return np.load(cache_path, mmap_mode='r')
+
+    layer = io.imread(path)
+    if funcs:
+        layer = apply_chain(layer, compile_chain(list(funcs)))
+    layer = img_as_float32(layer)
+
+    if cache_dir is None:
+        return layer
+
+    # write under a temporary name first so a crash never leaves half a file behind
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+    with open(temp_path, 'wb') as file:
+        np.save(file, layer)
+    os.replace(temp_path, cache_path)
+    _evict(cache_dir, max_bytes, cache_path)
+    return np.load(cache_path, mmap_mode='r')
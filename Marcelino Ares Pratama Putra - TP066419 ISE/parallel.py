@@ -0,0 +1,117 @@
+from multiprocessing import shared_memory
+from collections import namedtuple
+import multiprocessing
+import functools
+import numpy as np
+import os
+
+# arrays smaller than this are cheaper to pickle than to share
+SHARE_MIN_BYTES = 1 << 16
+
+# stands in for an array that was copied into a shared memory block
+_SharedArray = namedtuple('_SharedArray', ['name', 'shape', 'dtype'])
+
+def share(state, blocks, memo=None):
+    """
+    Copy the large arrays in a nested structure into shared memory.
+
+    Dictionaries, lists, tuples and functools.partial arguments are walked,
+    everything else is left to pickle. The same array is only copied once.
+
+    :param state: Structure to share.
+    :param blocks: List that receives the created SharedMemory blocks, the
+                   caller closes and unlinks them with release.
+    :return: Picklable structure for attach.
+    """
+    if memo is None:
+        memo = {}
+    if isinstance(state, np.ndarray) and state.nbytes >= SHARE_MIN_BYTES:
+        if id(state) not in memo:
+            block = shared_memory.SharedMemory(create=True, size=state.nbytes)
+            blocks.append(block)
+            np.copyto(np.ndarray(state.shape, dtype=state.dtype, buffer=block.buf), state)
+            memo[id(state)] = _SharedArray(block.name, state.shape, state.dtype.str)
+        return memo[id(state)]
+    if isinstance(state, dict):
+        return {key: share(value, blocks, memo) for key, value in state.items()}
+    if isinstance(state, list):
+        return [share(value, blocks, memo) for value in state]
+    if type(state) is tuple:
+        return tuple(share(value, blocks, memo) for value in state)
+    if isinstance(state, functools.partial):
+        return functools.partial(state.func, *share(state.args, blocks, memo), **share(state.keywords, blocks, memo))
+    return state
+
+def attach(state, blocks):
+    """
+    Undo share in another process. Shared arrays come back read only.
+
+    :param state: Structure returned by share.
+    :param blocks: List that receives the attached SharedMemory blocks,
+                   which have to stay open while the arrays are used.
+    """
+    if isinstance(state, _SharedArray):
+        block = shared_memory.SharedMemory(name=state.name)
+        blocks.append(block)
+        array = np.ndarray(state.shape, dtype=np.dtype(state.dtype), buffer=block.buf)
+        array.flags.writeable = False
+        return array
+    if isinstance(state, dict):
+        return {key: attach(value, blocks) for key, value in state.items()}
+    if isinstance(state, list):
+        return [attach(value, blocks) for value in state]
+    if type(state) is tuple:
+        return tuple(attach(value, blocks) for value in state)
+    if isinstance(state, functools.partial):
+        return functools.partial(state.func, *attach(state.args, blocks), **attach(state.keywords, blocks))
+    return state
+
+def release(blocks):
+    # close and remove shared memory blocks created by share
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+# set in every worker by _init_worker
+_worker = None
+
+def _init_worker(render, shared):
+    global _worker
+    blocks = []
+    _worker = (render, attach(shared, blocks), blocks)
+
+def _run_task(task):
+    render, state, _ = _worker
+    return render(task, state)
+
+def imap_frames(render, tasks, state, workers=None):
+    """
+    Run render(task, state) for every task on a process pool.
+
+    The state is published once through shared memory instead of being
+    copied to every worker, and results come back in task order. render
+    has to be a module level function so it can be sent to the workers,
+    and scripts using this need an if __name__ == '__main__' guard.
+
+    :param render: Function taking a task and the shared state.
+    :param tasks: Tasks to run, for example frame indices.
+    :param state: Structure of arrays and parameters used by every task.
+    :param workers: Number of worker processes, None uses every core and 1
+                    runs the tasks in this process.
+    :return: Generator of render results in task order.
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    if workers == 1:
+        for task in tasks:
+            yield render(task, state)
+        return
+
+    blocks = []
+    try:
+        shared = share(state, blocks)
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(render, shared)) as pool:
+            for result in pool.imap(_run_task, tasks):
+                yield result
+    finally:
+        release(blocks)
@@ -2,6 +2,13 @@ import cv2
 import numpy as np
 from PIL import Image, ImageDraw
 import random
+import os
+import sys
+
+# gif_writer lives one folder up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gif_writer import GifWriter
+from parallel import imap_frames
 
 # Function to load an image and convert it to RGBA
 def load_image(image_path):
@@ -14,48 +21,54 @@ def load_image(image_path):
 def resize_to_match(base_image, image_to_resize):
     return image_to_resize.resize(base_image.size, Image.LANCZOS)
 
-# Load your layers
-layer1 = load_image('Shaun Chiang Kum Wah - TP062483 ISE/components2/dark.png')
-# layer2 = load_image('path_to_your_image/layer2.png')
-layer3 = load_image('Shaun Chiang Kum Wah - TP062483 ISE/components2/arcdetriomphe_bg.png')  # The layer to apply the glitch effect
-
-# Ensure all layers are the same size
-# layer2 = resize_to_match(layer1, layer2)
-layer3 = resize_to_match(layer1, layer3)
-
 # Function to create a glitch frame
-def create_glitch_frame(image, intensity=5):
+def create_glitch_frame(image, intensity=5, rng=random):
     width, height = image.size
     glitched_image = image.copy()
     
     for _ in range(intensity):
-        x_start = random.randint(0, width - 50)
-        y_start = random.randint(0, height - 50)
-        x_end = random.randint(x_start + 1, min(x_start + 50, width))
-        y_end = random.randint(y_start + 1, min(y_start + 50, height))
+        x_start = rng.randint(0, width - 50)
+        y_start = rng.randint(0, height - 50)
+        x_end = rng.randint(x_start + 1, min(x_start + 50, width))
+        y_end = rng.randint(y_start + 1, min(y_start + 50, height))
         
         box = (x_start, y_start, x_end, y_end)
         region = glitched_image.crop(box)
         
-        x_offset = random.randint(-30, 30)  # Increase offset range
-        y_offset = random.randint(-30, 30)  # Increase offset range
+        x_offset = rng.randint(-30, 30)  # Increase offset range
+        y_offset = rng.randint(-30, 30)  # Increase offset range
         glitched_image.paste(region, (x_start + x_offset, y_start + y_offset))
     
     return glitched_image
 
-# Create frames for the GIF
-frames = []
-for i in range(1, 10):
-    # Apply the glitch effect to layer3
-    glitched_layer = create_glitch_frame(layer3, intensity=i * 10)  # Increase intensity progressively
+# Function to render one frame of the GIF, runs in a worker process
+def render_frame(i, state):
+    layer1 = Image.fromarray(state['layer1'])
+    layer3 = Image.fromarray(state['layer3'])
+
+    # Apply the glitch effect to layer3, every frame has its own random numbers so frames can run in any order
+    glitched_layer = create_glitch_frame(layer3, intensity=i * 10, rng=random.Random(state['seed'] + i))  # Increase intensity progressively
     
     # Combine layers
     # combined = Image.alpha_composite(layer1.convert("RGBA"), layer2.convert("RGBA"))
     combined = Image.alpha_composite(layer1.convert("RGBA"), glitched_layer.convert("RGBA"))
-    
-    frames.append(combined)
+    return combined
+
+if __name__ == '__main__':
+    # Load your layers
+    layer1 = load_image('Shaun Chiang Kum Wah - TP062483 ISE/components2/dark.png')
+    # layer2 = load_image('path_to_your_image/layer2.png')
+    layer3 = load_image('Shaun Chiang Kum Wah - TP062483 ISE/components2/arcdetriomphe_bg.png')  # The layer to apply the glitch effect
+
+    # Ensure all layers are the same size
+    # layer2 = resize_to_match(layer1, layer2)
+    layer3 = resize_to_match(layer1, layer3)
 
-# Save the frames as a GIF
-gif_path = 'Shaun Chiang Kum Wah - TP062483 ISE/what_has_happened.gif'
-frames[0].save(gif_path, save_all=True, append_images=frames[1:], duration=100, loop=0)
+    # Create frames for the GIF on a process pool, writing each one as soon as it is ready
+    gif_path = 'Shaun Chiang Kum Wah - TP062483 ISE/what_has_happened.gif'
+    gif = GifWriter(gif_path, duration=100, loop=0)
+    state = {'layer1': np.asarray(layer1), 'layer3': np.asarray(layer3), 'seed': random.randrange(2 ** 32)}
+    for combined in imap_frames(render_frame, range(1, 10), state):
+        gif.append(combined)
 
+    gif.close()
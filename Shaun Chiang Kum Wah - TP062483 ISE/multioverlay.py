@@ -1,4 +1,7 @@
 from PIL import Image
+import numpy as np
+
+from sprite_blend import prepare_sprite, blend_sprite
 
 def overlay_multiple_images(base_image_path, overlay_images_info, output_image_path):
     """
@@ -39,7 +42,8 @@ def overlay_multiple_images(base_image_path, overlay_images_info, output_image_p
     # Paste the base image onto the new image
     new_image.paste(base_image, (0, -200))
     
-    # Overlay each image
+    # Overlay each image, blending in place with integer maths
+    new_pixels = np.array(new_image)
     for overlay_path, offset, resize_factor in overlay_images_info:
         overlay_image = Image.open(overlay_path).convert('RGBA')
         
@@ -49,8 +53,9 @@ def overlay_multiple_images(base_image_path, overlay_images_info, output_image_p
             new_size = (int(overlay_width * resize_factor), int(overlay_height * resize_factor))
             overlay_image = overlay_image.resize(new_size, Image.Resampling.LANCZOS)
         
-        # Paste the overlay image onto the new image with the specified offset
-        new_image.paste(overlay_image, offset, overlay_image)
+        # Blend the overlay image onto the new image with the specified offset, same pixels as paste with a mask
+        blend_sprite(new_pixels, prepare_sprite(overlay_image, 4), *offset)
+    new_image = Image.fromarray(new_pixels)
     
     # Save the resulting image
     new_image.save(output_image_path, format='PNG')
@@ -2,33 +2,35 @@ from PIL import Image, ImageEnhance
 import numpy as np
 import math
 
-def create_pulsating_gif(input_image_path, output_gif_path, frames=60, gif_duration=100, max_brightness=2.0):
+from gif_writer import GifWriter, build_palette
+from parallel import imap_frames
+
+def pulse_frame(i, state):
+    # Calculate the pulse factor (from neutral to high)
+    pulse_factor = (math.sin(2 * math.pi * i / state['frames']) + 1) / 2  # Sinusoidal wave between 0 and 1
+
+    # Adjust the image brightness
+    enhancer = ImageEnhance.Brightness(Image.fromarray(state['image']))
+    return enhancer.enhance(1 + pulse_factor * (state['max_brightness'] - 1))  # Neutral (1) to High (max_brightness)
+
+def create_pulsating_gif(input_image_path, output_gif_path, frames=60, gif_duration=100, max_brightness=2.0, workers=None):
     # Load the image
     original_image = Image.open(input_image_path).convert('RGB')
     
-    # List to hold the frames for the GIF
-    pulse_frames = []
-
-    # Generate frames with pulsating intensity
-    for i in range(frames):
-        # Calculate the pulse factor (from neutral to high)
-        pulse_factor = (math.sin(2 * math.pi * i / frames) + 1) / 2  # Sinusoidal wave between 0 and 1
-        
-        # Adjust the image brightness
-        enhancer = ImageEnhance.Brightness(original_image)
-        pulsed_image = enhancer.enhance(1 + pulse_factor * (max_brightness - 1))  # Neutral (1) to High (max_brightness)
-        
-        # Add the pulsed image to the frames list
-        pulse_frames.append(pulsed_image)
-    
-    # Save the frames as a GIF
-    pulse_frames[0].save(
-        output_gif_path, 
-        save_all=True, 
-        append_images=pulse_frames[1:], 
-        duration=gif_duration, 
-        loop=0
-    )
+    # share one palette between all frames, sampled from dim to bright
+    enhancer = ImageEnhance.Brightness(original_image)
+    palette = build_palette([enhancer.enhance(factor) for factor in np.linspace(1, max_brightness, 3)])
+
+    # Write the GIF one frame at a time
+    gif = GifWriter(output_gif_path, duration=gif_duration, loop=0, palette=palette)
+
+    # Generate frames with pulsating intensity on a process pool, the image is shared with the workers
+    state = {'image': np.asarray(original_image), 'frames': frames, 'max_brightness': max_brightness}
+    for pulsed_image in imap_frames(pulse_frame, range(frames), state, workers):
+        # Add the pulsed image to the GIF
+        gif.append(pulsed_image)
+
+    gif.close()
 
     print(f"Pulsating GIF saved as {output_gif_path}")
 
@@ -41,4 +43,5 @@ frames = 80  # Number of frames in the GIF
 gif_duration = 40  # Duration of each frame in milliseconds
 max_brightness = 1.5  # Maximum brightness factor (2.0 means double the brightness)
 
-create_pulsating_gif(input_image_path, output_gif_path, frames, gif_duration, max_brightness)
+if __name__ == '__main__':
+    create_pulsating_gif(input_image_path, output_gif_path, frames, gif_duration, max_brightness)
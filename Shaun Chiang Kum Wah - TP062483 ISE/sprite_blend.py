@@ -0,0 +1,52 @@
+import numpy as np
+
+def prepare_sprite(sprite, channels=3):
+    """
+    Premultiply a sprite once so it can be blended many times.
+
+    :param sprite: 8 bit image whose last channel is alpha, e.g. RGBA or BGRA.
+    :param channels: Number of channels of the images it will be blended
+                     into. With 4 the alpha channel is blended like a
+                     colour, which is what PIL's paste with a mask does.
+    :return: Dictionary with the premultiplied colours and 255 - alpha,
+             both as uint16.
+    """
+    sprite = np.asarray(sprite)
+    alpha = sprite[:, :, 3:4].astype(np.uint16)
+    return {
+        'premultiplied': sprite[:, :, :channels] * alpha,
+        'inverse_alpha': 255 - alpha
+    }
+
+def blend_sprite(image, sprite, x=0, y=0):
+    """
+    Blend a prepared sprite into an 8 bit image in place, with its top left
+    corner at (x, y). Parts outside the image are skipped.
+
+    Uses integer maths in uint16: dst * (255 - a) + src * a, divided by 255
+    with rounding. This gives the same pixels as the float blend to within
+    one level.
+
+    :param image: uint8 image, modified in place.
+    :param sprite: Sprite from prepare_sprite.
+    :return: The image.
+    """
+    sprite_height, sprite_width = sprite['inverse_alpha'].shape[:2]
+    top, left = max(y, 0), max(x, 0)
+    bottom, right = min(y + sprite_height, image.shape[0]), min(x + sprite_width, image.shape[1])
+    if top >= bottom or left >= right:
+        return image
+
+    source = (slice(top - y, bottom - y), slice(left - x, right - x))
+    region = image[top:bottom, left:right]
+
+    # 255 * 255 + 128 still fits in 16 bits
+    blend = region * sprite['inverse_alpha'][source]
+    blend += sprite['premultiplied'][source]
+    blend += 128
+
+    # exact rounded division by 255: (t + (t >> 8)) >> 8
+    blend += blend >> 8
+    blend >>= 8
+    region[...] = blend
+    return image